@@ -0,0 +1,305 @@
+import logging
+import requests
+from urllib.parse import urlsplit
+import config
+import metrics
+import tracing
+
+
+class Event:
+    """
+    Событие GitHub из ленты /events в том виде, в каком его использует зеркало.
+    """
+
+    def __init__(self, data):
+        self.id = data["id"]
+        self.type = data["type"]
+        self.payload = data.get("payload", {})
+        self.created_at = data.get("created_at")
+
+
+class PullCommit:
+    def __init__(self, sha, message):
+        self.sha = sha
+        self.message = message
+
+
+class PullInfo:
+    """
+    Данные PR предка, необходимые для зеркалирования.
+    Может быть получен из GraphQL запроса или из объекта PullRequest PyGithub.
+    Если список коммитов не пришёл вместе с PR, он загружается через commits_loader
+    при первом обращении.
+    """
+
+    def __init__(self, number, title, body, merge_commit_sha, merged_at=None, commits=None, commits_loader=None):
+        self.number = number
+        self.title = title
+        self.body = body
+        self.merge_commit_sha = merge_commit_sha
+        self.merged_at = merged_at
+        self.commits = commits
+        self.commits_loader = commits_loader
+
+    @classmethod
+    def from_pull(cls, pull):
+        def load_commits():
+            metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls/{number}/commits")
+            with tracing.span("api", method="GET", endpoint="/repos/{owner}/{repo}/pulls/{number}/commits"):
+                return [PullCommit(c.sha, c.commit.message) for c in pull.get_commits()]
+
+        return cls(pull.number, pull.title, pull.body, pull.merge_commit_sha, merged_at=pull.merged_at,
+                   commits_loader=load_commits)
+
+    @classmethod
+    def from_graphql(cls, node, commits_loader=None):
+        merge_commit = node.get("mergeCommit") or {}
+        commits = None
+        connection = node.get("commits")
+        # Список коммитов в ответе ограничен одной страницей, длинные PR догружаются отдельно
+        if connection and connection["totalCount"] <= len(connection["nodes"]):
+            commits = [PullCommit(c["commit"]["oid"], c["commit"]["message"]) for c in connection["nodes"]]
+        return cls(node["number"], node["title"], node.get("body"), merge_commit.get("oid"),
+                   merged_at=node.get("mergedAt"), commits=commits, commits_loader=commits_loader)
+
+    def get_commits(self):
+        if self.commits is None and self.commits_loader is not None:
+            self.commits = self.commits_loader()
+        return self.commits or []
+
+
+class GraphQLError(Exception):
+    pass
+
+
+MERGED_PULLS_QUERY = """
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: MERGED, first: 100, after: $cursor, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { ...PullFields updatedAt }
+    }
+  }
+}
+"""
+
+OPEN_PULLS_QUERY = """
+query($owner: String!, $name: String!, $first: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: OPEN, first: $first, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      nodes { number headRefOid }
+    }
+  }
+}
+"""
+
+PULL_FIELDS = """
+fragment PullFields on PullRequest {
+  number title body mergedAt
+  mergeCommit { oid }
+  commits(first: 100) { totalCount nodes { commit { oid message } } }
+}
+"""
+
+# Сколько PR запрашивается одним GraphQL запросом при пакетной загрузке
+PULLS_BATCH_SIZE = 50
+
+
+class GithubClient:
+    """
+    Лёгкий клиент REST API GitHub поверх одной HTTP сессии.
+    Используется там, где PyGithub не даёт управлять заголовками запроса.
+    """
+
+    def __init__(self, base_url="https://api.github.com"):
+        self.logger = logging.getLogger("log")
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if config.username and config.password:
+            self.session.auth = (config.username, config.password)
+        elif config.api_key:
+            self.session.headers["Authorization"] = f"token {config.api_key}"
+        # Квоты по X-RateLimit-Resource: core для REST, graphql для GraphQL и т.д.
+        # Вид -> (оставшиеся запросы, время сброса в секундах epoch)
+        self.quotas = {}
+
+    @property
+    def requests_left(self):
+        return self.quotas.get("core", (None, None))[0]
+
+    @property
+    def reset_time(self):
+        return self.quotas.get("core", (None, None))[1]
+
+    def request(self, method, url, etag=None, **kwargs):
+        if not url.startswith("http"):
+            url = f"{self.base_url}{url}"
+        headers = kwargs.pop("headers", {})
+        if etag:
+            headers["If-None-Match"] = etag
+        endpoint = endpoint_template(url)
+        if endpoint != "/graphql":
+            metrics.api_calls.inc("rest", endpoint)
+        with tracing.span("api", method=method, endpoint=endpoint) as fields:
+            response = self.session.request(method, url, headers=headers, timeout=30, **kwargs)
+            fields["status"] = response.status_code
+        if "X-RateLimit-Remaining" in response.headers:
+            resource = response.headers.get("X-RateLimit-Resource") or ("graphql" if endpoint == "/graphql" else "core")
+            self.quotas[resource] = (int(response.headers["X-RateLimit-Remaining"]),
+                                     int(response.headers["X-RateLimit-Reset"]))
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def graphql(self, query, variables=None, partial=False, operation="query"):
+        """
+        Выполняет GraphQL запрос. При partial=True ошибки отдельных полей
+        (например, несуществующий PR) не прерывают запрос, если данные получены.
+        operation - имя запроса в метриках.
+        """
+        metrics.api_calls.inc("graphql", operation)
+        response = self.request("POST", "/graphql", json={"query": query, "variables": variables or {}})
+        data = response.json()
+        if data.get("errors"):
+            message = "; ".join(error.get("message", "") for error in data["errors"])
+            if not partial or not data.get("data"):
+                raise GraphQLError(message)
+            self.logger.warning(f"GraphQL запрос выполнен с ошибками: {message}")
+        return data["data"]
+
+    def get_pull_commits(self, owner, name, number):
+        commits = []
+        url = f"/repos/{owner}/{name}/pulls/{number}/commits?per_page=100"
+        while url:
+            response = self.request("GET", url)
+            commits.extend(PullCommit(c["sha"], c["commit"]["message"]) for c in response.json())
+            url = response.links.get("next", {}).get("url")
+        return commits
+
+    def pull_from_graphql(self, owner, name, node):
+        return PullInfo.from_graphql(
+            node, commits_loader=lambda: self.get_pull_commits(owner, name, node["number"]))
+
+    def get_pulls(self, owner, name, numbers):
+        """
+        Загружает данные нескольких PR пакетными GraphQL запросами.
+        Возвращает словарь номер -> PullInfo, ненайденные PR в него не попадают.
+        """
+        pulls = {}
+        numbers = list(numbers)
+        for start in range(0, len(numbers), PULLS_BATCH_SIZE):
+            chunk = numbers[start:start + PULLS_BATCH_SIZE]
+            fields = "\n".join(f"pr{number}: pullRequest(number: {int(number)}) {{ ...PullFields }}"
+                               for number in chunk)
+            query = ("query($owner: String!, $name: String!) {\n"
+                     f"  repository(owner: $owner, name: $name) {{\n{fields}\n  }}\n}}\n" + PULL_FIELDS)
+            data = self.graphql(query, {"owner": owner, "name": name}, partial=True,
+                                operation="pulls_batch")
+            for node in data["repository"].values():
+                if node:
+                    pulls[node["number"]] = self.pull_from_graphql(owner, name, node)
+        return pulls
+
+    def get_merged_pulls_since(self, owner, name, since):
+        """
+        Возвращает PR, слитые не раньше since, от новых к старым.
+        GraphQL не сортирует PR по mergedAt, поэтому список идёт по updatedAt:
+        PR, слитый после since, обновлён не раньше since, и обход прекращается
+        на первом PR, обновлённом до since.
+        """
+        # Даты GitHub и since в одном формате ISO 8601 UTC, их можно сравнивать как строки
+        pulls = []
+        cursor = None
+        while True:
+            data = self.graphql(MERGED_PULLS_QUERY + PULL_FIELDS, {"owner": owner, "name": name, "cursor": cursor},
+                                operation="merged_pulls")
+            connection = data["repository"]["pullRequests"]
+            for node in connection["nodes"]:
+                if node["updatedAt"] < since:
+                    return sort_by_merge_date(pulls)
+                if node["mergedAt"] and node["mergedAt"] >= since:
+                    pulls.append(self.pull_from_graphql(owner, name, node))
+            if not connection["pageInfo"]["hasNextPage"]:
+                return sort_by_merge_date(pulls)
+            cursor = connection["pageInfo"]["endCursor"]
+
+    def get_open_pull_heads(self, owner, name, limit=100):
+        """
+        Возвращает словарь номер -> коммит вершины для limit недавно обновлённых открытых PR.
+        """
+        data = self.graphql(OPEN_PULLS_QUERY, {"owner": owner, "name": name, "first": min(limit, 100)},
+                            operation="open_pulls")
+        return {node["number"]: node["headRefOid"] for node in data["repository"]["pullRequests"]["nodes"]}
+
+    def poll_events(self, full_name, last_seen_id, etag=None, max_pages=None):
+        """
+        Запрашивает ленту событий репозитория условным запросом и листает её только
+        до последнего уже виденного события.
+        Возвращает новые события (от старых к новым) и EventPoll с метаданными опроса.
+        """
+        poll = EventPoll()
+        url = f"/repos/{full_name}/events?per_page=100"
+        events = []
+        while url:
+            response = self.request("GET", url, etag=etag if not poll.pages else None)
+            if not poll.pages:
+                poll.poll_interval = int(response.headers.get("X-Poll-Interval", 0))
+                if response.status_code == 304:
+                    poll.not_modified = True
+                    poll.etag = etag
+                    return [], poll
+                poll.etag = response.headers.get("ETag")
+                poll.total_pages = last_page_number(response) or 1
+            poll.pages += 1
+
+            reached_seen = False
+            for data in response.json():
+                if last_seen_id is not None and int(data["id"]) <= last_seen_id:
+                    reached_seen = True
+                    break
+                events.append(Event(data))
+            if reached_seen or poll.pages == max_pages:
+                poll.reached_seen = reached_seen
+                break
+            url = response.links.get("next", {}).get("url")
+
+        events.sort(key=lambda e: int(e.id))
+        return events, poll
+
+
+class EventPoll:
+    def __init__(self):
+        self.etag = None
+        self.not_modified = False
+        self.poll_interval = 0
+        self.pages = 0
+        self.total_pages = 0
+        # Лента пролистана до уже виденного события, пропусков нет
+        self.reached_seen = False
+
+
+def last_page_number(response):
+    last_url = response.links.get("last", {}).get("url")
+    if not last_url:
+        return None
+    for part in last_url.split("?", 1)[-1].split("&"):
+        key, _, value = part.partition("=")
+        if key == "page":
+            return int(value)
+    return None
+
+
+def endpoint_template(url):
+    """
+    Приводит адрес запроса к виду /repos/{owner}/{repo}/pulls/{number}, чтобы
+    метрики не размножались по репозиториям и номерам PR.
+    """
+    parts = urlsplit(url).path.strip("/").split("/")
+    if parts[0] == "repos" and len(parts) >= 3:
+        parts[1:3] = ["{owner}", "{repo}"]
+    return "/" + "/".join("{number}" if part.isdigit() else part for part in parts)
+
+
+def sort_by_merge_date(pulls):
+    return sorted(pulls, key=lambda pull: pull.merged_at, reverse=True)
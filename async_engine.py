@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import config
+import tools
+import fetch
+import mirror
+import push
+import patch_index
+import metrics
+import progress
+import tracing
+from gitcmd import run_git, git_output
+
+
+class AsyncEngine:
+    """
+    Конвейер зеркалирования на asyncio.
+    Приём событий, загрузка данных PR, перенос и отправка изменений и создание PR
+    выполняются отдельными этапами, связанными ограниченными очередями, поэтому
+    долгий push не задерживает обнаружение следующего слияния.
+    """
+
+    def __init__(self, group):
+        self.logger = logging.getLogger("log")
+        self.group = group
+        self.loop = None
+        self.events = None
+        self.ready = None
+        self.applied = None
+        self.pushed = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.logger.info("Асинхронный движок зеркалирования запущен.")
+        self.loop = asyncio.get_running_loop()
+        self.events = asyncio.Queue(config.async_queue_size)
+        self.ready = asyncio.Queue(config.async_queue_size)
+        self.applied = asyncio.Queue(config.async_queue_size)
+        self.pushed = asyncio.Queue(config.async_queue_size)
+        metrics.queue_depth.set_callback("async", self.queue_depths)
+        stages = [self.resolve_pulls(), self.push_branches(), self.open_pulls(), self.retry_pending()]
+        stages += [self.apply_pulls() for _ in range(sum(mirror.pool.size for mirror in self.group.mirrors))]
+        workers = [asyncio.create_task(stage) for stage in stages]
+        try:
+            await self.intake()
+            # Поток событий завершился: дожидаемся обработки того, что уже в очередях
+            for stage_queue in (self.events, self.ready, self.applied, self.pushed):
+                await stage_queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def queue_depths(self):
+        return {("all", name): stage_queue.qsize()
+                for name, stage_queue in (("events", self.events), ("ready", self.ready),
+                                          ("applied", self.applied), ("pushed", self.pushed))}
+
+    async def intake(self):
+        """
+        Источник событий работает в отдельном потоке и блокируется, если следующий
+        этап не успевает разбирать очередь.
+        """
+        await asyncio.to_thread(self.read_events)
+
+    def read_events(self):
+        if config.event_source == "webhook":
+            source = self.group.webhook_events(run_pending=False)
+        else:
+            source = self.group.poll_events(run_pending=False)
+        try:
+            for repo, event in source:
+                asyncio.run_coroutine_threadsafe(self.events.put((repo, event)), self.loop).result()
+        except Exception:
+            self.logger.exception("Ошибка при получении событий из GitHub.")
+
+    async def retry_pending(self):
+        """
+        Отложенные задачи и повторы разбираются отдельно от приёма событий.
+        """
+        while True:
+            await asyncio.to_thread(self.group.run_pending)
+            await asyncio.sleep(config.event_stream_wait)
+
+    async def resolve_pulls(self):
+        while True:
+            batch = [await self.events.get()]
+            # Всё, что накопилось в очереди, загружается одним пакетным запросом
+            while not self.events.empty() and len(batch) < 50:
+                batch.append(self.events.get_nowait())
+
+            try:
+                await self.resolve_batch(batch)
+            except Exception:
+                self.logger.exception("Ошибка при обработке событий GitHub.")
+            finally:
+                for _ in batch:
+                    self.events.task_done()
+
+    async def resolve_batch(self, batch):
+        pending = []
+        for repo, event in batch:
+            for bot in self.group.mirrors_of(repo):
+                pr_number = self.merged_pull_number(bot, repo, event)
+                if pr_number is None:
+                    # Комментарии и прочие события обрабатываются как прежде, через планировщик
+                    await asyncio.to_thread(bot.handle_event, repo, event)
+                elif tools.check_processed_pr(bot.store, pr_number):
+                    self.logger.info(f"PR {pr_number} уже был отработан. Пропуск")
+                else:
+                    tools.add_processing_pr(bot.store, pr_number)
+                    if config.batch_mode:
+                        # Пакет отправляет планировщик на этапе retry_pending
+                        await asyncio.to_thread(bot.add_to_batch, pr_number)
+                    else:
+                        pending.append((bot, pr_number))
+        if not pending:
+            return
+
+        # Данные PR запрашиваются один раз на репозиторий предка, даже если его зеркалируют несколько пар
+        upstreams = {}
+        for bot, pr_number in pending:
+            upstreams.setdefault(bot.upstream.full_name, (bot.upstream, set()))[1].add(pr_number)
+        pulls = {}
+        for full_name, (upstream, pr_numbers) in upstreams.items():
+            pulls[full_name] = await asyncio.to_thread(
+                mirror.prefetch_pulls, self.group.client, upstream, sorted(pr_numbers))
+
+        for bot, pr_number in pending:
+            pull = pulls[bot.upstream.full_name].get(pr_number)
+            if pull is None or not bot.scheduler.has_budget("mirror"):
+                bot.scheduler.submit("mirror", pr_number)
+                continue
+            await self.ready.put((bot, pull))
+
+    def merged_pull_number(self, bot, repo, event):
+        if event.type != "PullRequestEvent" or repo.full_name != bot.upstream.full_name:
+            return None
+        if event.payload.get("action") != "closed" or not event.payload["pull_request"].get("merged"):
+            return None
+        return int(event.payload["pull_request"]["number"])
+
+    async def apply_pulls(self):
+        while True:
+            bot, pull = await self.ready.get()
+            branch = f"{config.mirror_branch_prefix}{pull.number}"
+            try:
+                with tracing.pull(bot.upstream.full_name, pull.number):
+                    self.logger.info(f"Зеркалирование PR #{pull.number} ({bot.pair}).")
+                    built = await self.apply_in_pool(bot, pull, branch)
+                if built:
+                    await self.applied.put((bot, pull, branch, *built))
+            finally:
+                self.ready.task_done()
+
+    async def apply_in_pool(self, bot, pull, branch):
+        state = progress.get(bot.store, pull.number)
+        if progress.reached(state, progress.OPENED):
+            tools.add_processed_pr(bot.store, pull.number)
+            return None
+        workdir = await asyncio.to_thread(bot.pool.free.get)
+        try:
+            await asyncio.to_thread(fetch.fetch_for_pulls, workdir, [pull])
+            built = await asyncio.to_thread(progress.built_branch, workdir, state)
+            if built:
+                return built[1:]
+            if await asyncio.to_thread(patch_index.skip_if_applied, workdir, bot.store, pull):
+                tools.add_processed_pr(bot.store, pull.number)
+                return None
+            mirror.record_fetched(bot.store, pull)
+            head, conflicts = await asyncio.to_thread(mirror.apply_pull, workdir, pull, branch)
+            base_sha = await asyncio.to_thread(git_output, workdir, "merge-base", branch, "downstream/master")
+            progress.record(bot.store, pull.number, progress.APPLIED, branch=branch, head=head, base_sha=base_sha,
+                            conflicts=" ".join(conflicts))
+            return head, base_sha
+        except Exception:
+            self.logger.exception(f"Во время зеркалирования PR #{pull.number} произошла ошибка.")
+            bot.scheduler.submit("mirror", pull.number)
+            return None
+        finally:
+            bot.pool.free.put(workdir)
+
+    async def push_branches(self):
+        """
+        Забирает все готовые ветки из очереди и отправляет ветки каждой пары одним git push.
+        """
+        while True:
+            batch = [await self.applied.get()]
+            while not self.applied.empty():
+                batch.append(self.applied.get_nowait())
+
+            groups = {}
+            for bot, pull, branch, head, base_sha in batch:
+                groups.setdefault(id(bot), (bot, []))[1].append((pull, branch, head, base_sha))
+            try:
+                for bot, items in groups.values():
+                    await self.push_group(bot, items)
+            finally:
+                for _ in batch:
+                    self.applied.task_done()
+
+    async def push_group(self, bot, items):
+        refs = {branch: head for _, branch, head, _ in items}
+        try:
+            with metrics.timed("push"):
+                result = await asyncio.to_thread(run_git, bot.pool.repo_directory,
+                                                 *push.push_arguments(refs, atomic=config.push_atomic))
+            landed = push.parse_porcelain(result.stdout.decode(errors="replace"), list(refs))
+        except Exception:
+            self.logger.exception("Ошибка при отправке веток в потомка.")
+            landed = {}
+        for pull, branch, _, base_sha in items:
+            if landed.get(branch):
+                progress.record(bot.store, pull.number, progress.PUSHED)
+                await self.pushed.put((bot, pull, branch, base_sha))
+            else:
+                self.logger.error(f"Ветка {branch} не отправлена в потомка.")
+                bot.scheduler.submit("mirror", pull.number)
+
+    async def open_pulls(self):
+        while True:
+            bot, pull, branch, base_sha = await self.pushed.get()
+            try:
+                await self.open_pull(bot, pull, branch, base_sha)
+            finally:
+                self.pushed.task_done()
+
+    async def open_pull(self, bot, pull, branch, base_sha):
+        with tracing.pull(bot.upstream.full_name, pull.number):
+            try:
+                # PR, созданные до перезапуска, находит progress.recover при старте
+                await asyncio.to_thread(mirror.open_or_find_pull, bot.downstream, pull, branch, bot.store, base_sha)
+                tools.add_processed_pr(bot.store, pull.number)
+            except Exception:
+                self.logger.exception(f"Не удалось создать PR для #{pull.number}.")
+                bot.scheduler.submit("mirror", pull.number)
+
@@ -0,0 +1,441 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlsplit, parse_qs
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+import metrics
+import tools
+import pairs
+import mirror
+
+# Виды синтетических PR: squash - один коммит, влитый перемоткой; merge - ветка из одного
+# коммита с коммитом слияния; multi - ветка из нескольких коммитов; conflict - изменение,
+# конфликтующее с правкой в потомке; applied - изменение, уже перенесённое в потомка вручную
+SHAPES = ["squash", "merge", "multi", "conflict", "applied"]
+
+UPSTREAM = "bench/upstream"
+DOWNSTREAM = "bench/downstream"
+
+
+def git(workdir, *args):
+    return subprocess.check_output(["git", *args], cwd=workdir, stderr=subprocess.DEVNULL).decode().strip()
+
+
+def commit_file(workdir, path, content, message):
+    full_path = os.path.join(workdir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(content)
+    git(workdir, "add", path)
+    git(workdir, "commit", "-q", "-m", message)
+    return git(workdir, "rev-parse", "HEAD")
+
+
+class SyntheticRepos:
+    """
+    Голые репозитории предка и потомка в каталоге root/git и описание слитых PR.
+    Потомок - общий базовый коммит и правка shared.txt, с которой конфликтуют PR вида conflict.
+    """
+
+    def __init__(self, root, pr_count, shapes, files_per_commit):
+        self.root = root
+        self.pr_count = pr_count
+        self.shapes = shapes
+        self.files_per_commit = files_per_commit
+        self.pulls = {}
+        self.git_root = os.path.join(root, "git")
+        self.pristine_downstream = os.path.join(root, "downstream-pristine.git")
+
+    def build(self):
+        work = os.path.join(self.root, "src")
+        os.makedirs(work)
+        git(work, "init", "-q", "-b", "master")
+        git(work, "config", "user.name", "Benchmark")
+        git(work, "config", "user.email", "benchmark@example.com")
+        commit_file(work, "shared.txt", "shared\n", "Base")
+
+        git(work, "checkout", "-q", "-b", "downstream")
+        commit_file(work, "shared.txt", "downstream\n", "Downstream change")
+        git(work, "checkout", "-q", "master")
+
+        merged_at = datetime.now(timezone.utc) - timedelta(minutes=self.pr_count)
+        for number in range(1, self.pr_count + 1):
+            shape = self.shapes[(number - 1) % len(self.shapes)]
+            merged_at += timedelta(minutes=1)
+            self.pulls[number] = self.make_pull(work, number, shape, merged_at.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+        git(self.root, "init", "-q", "--bare", self.pristine_downstream)
+        git(work, "push", "-q", self.pristine_downstream, "downstream:master")
+        upstream = os.path.join(self.git_root, UPSTREAM)
+        git(self.root, "init", "-q", "--bare", upstream)
+        git(work, "push", "-q", upstream, "master")
+        self.reset_downstream()
+
+    def make_pull(self, work, number, shape, merged_at):
+        title = f"Synthetic {shape} PR #{number}"
+        commits = []
+        if shape in ("squash", "applied"):
+            commits.append(self.change(work, number, 0, title))
+            merge_sha = commits[0]["sha"]
+            if shape == "applied":
+                git(work, "checkout", "-q", "downstream")
+                git(work, "cherry-pick", merge_sha)
+                git(work, "checkout", "-q", "master")
+        else:
+            git(work, "checkout", "-q", "-b", f"pr-{number}")
+            for index in range(3 if shape == "multi" else 1):
+                if shape == "conflict":
+                    sha = commit_file(work, "shared.txt", f"upstream {number}\n", f"{title}: conflict")
+                    commits.append({"sha": sha, "message": f"{title}: conflict"})
+                else:
+                    commits.append(self.change(work, number, index, f"{title}: commit {index}"))
+            git(work, "checkout", "-q", "master")
+            git(work, "merge", "-q", "--no-ff", f"pr-{number}", "-m", f"Merge pull request #{number}")
+            merge_sha = git(work, "rev-parse", "HEAD")
+        return {"number": number, "title": title, "body": f"Benchmark PR of shape {shape}",
+                "shape": shape, "merge_commit_sha": merge_sha, "merged_at": merged_at, "commits": commits}
+
+    def change(self, work, number, index, message):
+        os.makedirs(os.path.join(work, f"pr-{number}"), exist_ok=True)
+        for file_index in range(self.files_per_commit):
+            path = os.path.join(f"pr-{number}", f"file-{index}-{file_index}.txt")
+            with open(os.path.join(work, path), "w") as f:
+                f.write(f"PR {number}, commit {index}, file {file_index}\n")
+            git(work, "add", path)
+        git(work, "commit", "-q", "-m", message)
+        return {"sha": git(work, "rev-parse", "HEAD"), "message": message}
+
+    def reset_downstream(self):
+        downstream = os.path.join(self.git_root, DOWNSTREAM)
+        shutil.rmtree(downstream, ignore_errors=True)
+        shutil.copytree(self.pristine_downstream, downstream)
+
+
+class FakeGithub:
+    """
+    Локальная имитация той части REST и GraphQL API GitHub, которую использует зеркало.
+    Считает запросы по адресам и запоминает созданные PR.
+    """
+
+    def __init__(self, pulls):
+        self.pulls = pulls
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.created = []
+        self.requests_left = 5000
+        self.graphql_left = 5000
+        self.server = None
+        self.url = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.handle(self, "GET")
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.created = []
+
+    def handle(self, handler, method):
+        url = urlsplit(handler.path)
+        path, query = url.path, parse_qs(url.query)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = json.loads(handler.rfile.read(length) or b"null")
+        endpoint = method + " " + re.sub(r"/repos/[^/]+/[^/]+", "/repos/{owner}/{repo}",
+                                         re.sub(r"/\d+", "/{number}", path))
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            if path == "/graphql":
+                self.graphql_left -= 1
+                resource, remaining = "graphql", self.graphql_left
+            else:
+                self.requests_left -= 1
+                resource, remaining = "core", self.requests_left
+            status, data = self.route(method, path, body, query)
+
+        encoded = json.dumps(data).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(encoded)))
+        handler.send_header("X-RateLimit-Limit", "5000")
+        handler.send_header("X-RateLimit-Remaining", str(remaining))
+        handler.send_header("X-RateLimit-Resource", resource)
+        handler.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        handler.end_headers()
+        handler.wfile.write(encoded)
+
+    def route(self, method, path, body, query=None):
+        if path == "/graphql":
+            return 200, self.graphql(body["query"])
+        if path == "/rate_limit":
+            core = {"limit": 5000, "remaining": self.requests_left, "reset": int(time.time()) + 3600, "used": 0}
+            return 200, {"resources": {"core": core}, "rate": core}
+        match = re.fullmatch(r"/repos/([^/]+)/([^/]+)(/pulls(?:/(\d+)(/commits)?)?)?", path)
+        if not match:
+            return 404, {"message": "Not Found"}
+        full_name = f"{match.group(1)}/{match.group(2)}"
+        if match.group(3) is None:
+            return 200, self.repo_json(full_name)
+        if method == "POST":
+            self.created.append(body)
+            return 201, self.pull_json(full_name, {"number": len(self.created), "title": body["title"],
+                                                   "body": body["body"], "merge_commit_sha": None,
+                                                   "merged_at": None})
+        if match.group(4) is None:
+            # Поиск созданных PR по ветке, как при восстановлении после сбоя
+            head = (query or {}).get("head", [""])[0].split(":")[-1]
+            return 200, [self.pull_json(full_name, {"number": number, "title": created["title"],
+                                                    "body": created["body"], "merge_commit_sha": None,
+                                                    "merged_at": None})
+                         for number, created in enumerate(self.created, 1) if created["head"] == head]
+        pull = self.pulls.get(int(match.group(4) or 0))
+        if pull is None:
+            return 404, {"message": "Not Found"}
+        if match.group(5):
+            return 200, [{"sha": c["sha"], "commit": {"message": c["message"]}} for c in pull["commits"]]
+        return 200, self.pull_json(full_name, pull)
+
+    def repo_json(self, full_name):
+        owner, name = full_name.split("/")
+        return {"id": abs(hash(full_name)), "name": name, "full_name": full_name, "owner": {"login": owner},
+                "url": f"{self.url}/repos/{full_name}", "html_url": f"{config.github_url}/{full_name}"}
+
+    def pull_json(self, full_name, pull):
+        return {"number": pull["number"], "title": pull["title"], "body": pull["body"],
+                "merge_commit_sha": pull["merge_commit_sha"], "merged_at": pull["merged_at"],
+                "url": f"{self.url}/repos/{full_name}/pulls/{pull['number']}",
+                "html_url": f"{config.github_url}/{full_name}/pull/{pull['number']}"}
+
+    def graphql_node(self, pull):
+        return {"number": pull["number"], "title": pull["title"], "body": pull["body"],
+                "mergedAt": pull["merged_at"], "updatedAt": pull["merged_at"],
+                "mergeCommit": {"oid": pull["merge_commit_sha"]},
+                "commits": {"totalCount": len(pull["commits"]),
+                            "nodes": [{"commit": {"oid": c["sha"], "message": c["message"]}}
+                                      for c in pull["commits"]]}}
+
+    def graphql(self, query):
+        if "pullRequests(" in query:
+            nodes = [self.graphql_node(pull) for pull in
+                     sorted(self.pulls.values(), key=lambda pull: pull["merged_at"], reverse=True)]
+            connection = {"pageInfo": {"hasNextPage": False, "endCursor": None}, "nodes": nodes}
+            return {"data": {"repository": {"pullRequests": connection}}}
+        repository = {}
+        for alias, number in re.findall(r"(\w+): pullRequest\(number: (\d+)\)", query):
+            pull = self.pulls.get(int(number))
+            repository[alias] = self.graphql_node(pull) if pull else None
+        return {"data": {"repository": repository}}
+
+
+class PhaseRecorder:
+    """
+    Собирает все наблюдения гистограммы этапов, чтобы посчитать процентили.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        metrics.phase_seconds.add_listener(self.observe)
+
+    def observe(self, value, phase):
+        self.samples.setdefault(phase, []).append(value)
+
+    def reset(self):
+        self.samples = {}
+
+    def summary(self):
+        return {phase: percentiles(values) for phase, values in sorted(self.samples.items())}
+
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    return {"count": len(ordered), "p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": round(ordered[-1], 4)}
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.root = tempfile.mkdtemp(prefix="mirror-benchmark-")
+        self.repos = SyntheticRepos(self.root, args.prs, args.shapes, args.files)
+        self.fake = FakeGithub(self.repos.pulls)
+        self.recorder = PhaseRecorder()
+        self.run_number = 0
+
+    def configure(self):
+        config.username = ""
+        config.password = ""
+        config.api_key = "benchmark"
+        config.github_api_url = self.fake.url
+        config.github_url = f"file://{self.repos.git_root}"
+        config.upstream_owner, config.upstream_repo = UPSTREAM.split("/")
+        config.downstream_owner, config.downstream_repo = DOWNSTREAM.split("/")
+        config.mirror_pairs = []
+        config.work_log_file = None
+        config.apply_engine = self.args.engine
+        config.clone_strategy = self.args.clone_strategy
+        config.mirror_workers = self.args.workers
+        config.batch_mode = self.args.batch
+
+    def prepare_run(self, name):
+        """
+        Каждый сценарий начинается с чистого потомка, нового клона и пустого рабочего лога.
+        """
+        self.run_number += 1
+        self.repos.reset_downstream()
+        config.local_repo_directory = os.path.join(self.root, f"clone-{self.run_number}-{name}")
+        config.state_db_file = os.path.join(self.root, f"state-{self.run_number}-{name}.sqlite3")
+
+    def run(self):
+        self.repos.build()
+        self.fake.start()
+        self.configure()
+        try:
+            results = [self.run_mirror_pr(), self.run_backlog()]
+        finally:
+            self.fake.stop()
+        return {
+            "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "revision": self.revision(),
+            "parameters": {"prs": self.args.prs, "shapes": self.args.shapes, "files": self.args.files,
+                           "engine": self.args.engine, "clone_strategy": self.args.clone_strategy,
+                           "workers": self.args.workers, "batch": self.args.batch},
+            "scenarios": results
+        }
+
+    def run_mirror_pr(self):
+        """
+        Последовательное зеркалирование каждого PR через mirror_pr, как при обработке событий.
+        """
+        self.prepare_run("mirror_pr")
+        group = mirror.MirrorGroup(pairs.load_pairs())
+        group.initialize()
+        bot = group.mirrors[0]
+        self.start_measuring()
+        start = time.monotonic()
+        for number in sorted(self.repos.pulls):
+            with bot.pool.acquire() as workdir:
+                if mirror.mirror_pr(bot.upstream, bot.downstream, number, workdir, store=bot.store):
+                    tools.add_processed_pr(bot.store, number)
+        return self.result("mirror_pr", time.monotonic() - start, len(tools.get_processed_prs(bot.store)))
+
+    def run_backlog(self):
+        """
+        Запуск после простоя: все PR слиты после последней активации и разбираются в Mirror.initialize.
+        """
+        self.prepare_run("backlog")
+        store = tools.get_store(config.state_db_file)
+        since = datetime.now(timezone.utc) - timedelta(minutes=self.args.prs + 60)
+        tools.initialize_work_log(store, since.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        self.start_measuring()
+        start = time.monotonic()
+        mirror.MirrorGroup(pairs.load_pairs()).initialize()
+        # В пакетном режиме один PR потомка покрывает несколько PR предка
+        return self.result("backlog", time.monotonic() - start, len(tools.get_processed_prs(store)))
+
+    def start_measuring(self):
+        self.fake.reset()
+        self.recorder.reset()
+
+    def result(self, name, elapsed, mirrored=None):
+        if mirrored is None:
+            mirrored = len(self.fake.created)
+        api_calls = sum(self.fake.calls.values())
+        return {
+            "scenario": name,
+            "prs": self.args.prs,
+            "mirrored": mirrored,
+            "pulls_created": len(self.fake.created),
+            "seconds": round(elapsed, 3),
+            "prs_per_minute": round(mirrored / elapsed * 60, 2) if elapsed else None,
+            "phases": self.recorder.summary(),
+            "api_calls": {"total": api_calls,
+                          "per_pr": round(api_calls / self.args.prs, 2),
+                          "by_endpoint": dict(sorted(self.fake.calls.items()))}
+        }
+
+    def revision(self):
+        try:
+            return git(os.path.dirname(os.path.abspath(__file__)), "rev-parse", "HEAD")
+        except Exception:
+            return None
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def print_report(report):
+    for result in report["scenarios"]:
+        print(f"{result['scenario']}: {result['mirrored']}/{result['prs']} PR за {result['seconds']} с, "
+              f"{result['prs_per_minute']} PR/мин, {result['api_calls']['per_pr']} запросов API на PR")
+        for phase, stats in result["phases"].items():
+            print(f"  {phase}: p50 {stats['p50']} с, p90 {stats['p90']} с, p99 {stats['p99']} с, "
+                  f"макс. {stats['max']} с ({stats['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк зеркалирования на синтетических репозиториях.")
+    parser.add_argument("--prs", type=int, default=20, help="количество слитых PR")
+    parser.add_argument("--shapes", default=",".join(SHAPES),
+                        help=f"виды PR через запятую, по кругу: {', '.join(SHAPES)}")
+    parser.add_argument("--files", type=int, default=3, help="файлов в одном коммите PR")
+    parser.add_argument("--engine", default=config.apply_engine, choices=["worktree", "objects"])
+    parser.add_argument("--clone-strategy", default="full", choices=["full", "blobless", "shallow"])
+    parser.add_argument("--workers", type=int, default=config.mirror_workers)
+    parser.add_argument("--batch", action="store_true", help="разбирать бэклог в пакетном режиме")
+    parser.add_argument("--output", default="benchmark.json", help="файл с результатами в формате JSON")
+    parser.add_argument("--keep", action="store_true", help="не удалять временные репозитории")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.shapes = [shape.strip() for shape in args.shapes.split(",") if shape.strip()]
+    unknown = [shape for shape in args.shapes if shape not in SHAPES]
+    if unknown or not args.shapes:
+        parser.error(f"неизвестные виды PR: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(module)s - %(message)s")
+    logging.getLogger("log").setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    benchmark = Benchmark(args)
+    try:
+        report = benchmark.run()
+    finally:
+        if not args.keep:
+            benchmark.cleanup()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
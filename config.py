@@ -7,22 +7,123 @@ password = ""
 # or
 api_key = ""
 
+# Адреса GitHub. Для GitHub Enterprise или локальной имитации API (benchmark.py) заменяются
+github_api_url = "https://api.github.com"
+github_url = "https://github.com"
+
 upstream_owner = ""
 upstream_repo = ""
 
 downstream_owner = ""
 downstream_repo = ""
 
+# Несколько пар репозиториев в одном процессе. Если список пуст, зеркалируется одна пара,
+# заданная параметрами выше. Пример элемента:
+# {"upstream_owner": "...", "upstream_repo": "...", "downstream_owner": "...", "downstream_repo": "...",
+#  "local_repo_directory": "...", "state_db_file": "...", "mirror_workers": 2}
+# local_repo_directory, state_db_file и mirror_workers необязательны.
+mirror_pairs = []
+
 local_repo_directory = "local_downstream_clone"
+# Способ создания локального клона: "full" - полный клон, "blobless" - частичный клон
+# (--filter=blob:none), "shallow" - история только с даты последней активации
+clone_strategy = "full"
+# Глубина истории неглубокого клона, если дата последней активации ещё неизвестна
+shallow_since_days = 30
+# Сколько коммитов загружается вместе с коммитом слияния в неглубоком клоне
+# и сколько раз глубина удваивается, если истории не хватает
+shallow_fetch_depth = 2
+deepen_attempts = 5
 mirror_pr_title_prefix = "[Mirroring test. Please ignore] "
 mirror_branch_prefix = "upstream-merge-"
-
-# Подразумивается какое колличество последних PR мы хотим получить, чтобы проверить
-# пропущеные PR за время простоя программы
-depth_pr_check = 300
+# Количество PR, зеркалируемых одновременно. Каждому рабочему выделяется свой git worktree
+mirror_workers = 1
+# Способ переноса изменений: "worktree" - cherry-pick в рабочем каталоге,
+# "objects" - сборка коммитов через git merge-tree без обновления рабочего каталога
+apply_engine = "worktree"
 
 log_file = "mirror.log"
 work_log_file = "work_log.json"
+# Хранилище рабочего лога. Старый work_log_file переносится в него при первом запуске
+work_log_backend = "sqlite"
+state_db_file = "work_log.sqlite3"
 
 log_level = logging.INFO
+# Ротация файла лога: "size" - при достижении log_max_bytes, "time" - по расписанию
+# log_rotate_when (значения when у TimedRotatingFileHandler), "" - без ротации
+log_rotation = "size"
+log_max_bytes = 50 * 1024 * 1024
+log_rotate_when = "midnight"
+# Сколько старых файлов лога хранить
+log_backup_count = 7
+# Формат файла лога: "text" или "json" - одна JSON запись на строку
+log_format = "text"
+# Писать в файл лога длительность этапов переноса, команд git и запросов к GitHub API
+# с trace id PR, чтобы медленные PR можно было разобрать по логу
+trace_spans = True
 event_stream_wait = 60
+# Положение в лентах событий сохраняется в рабочем логе, и после перезапуска пропущенные
+# события дочитываются из ленты. Сколько последних обработанных событий каждого
+# репозитория помнить, чтобы при дочитывании не обработать событие дважды
+event_dedupe_window = 1000
+# Как часто (в секундах) работающий бот обновляет дату последнего включения в рабочем логе.
+# Записывается время прошлого обновления, чтобы слияния, ещё не дошедшие до ленты событий,
+# не оказались раньше этой даты. После сбоя список PR просматривается начиная с неё
+activation_day_interval = 3600
+
+# Движок: "sync" - события обрабатываются по одному в основном цикле,
+# "async" - приём событий, загрузка PR, перенос изменений и создание PR идут параллельно
+engine = "sync"
+# Размер очередей между этапами асинхронного движка
+async_queue_size = 100
+
+# Источник событий: "poll" - опрос ленты событий, "webhook" - приём вебхуков GitHub
+event_source = "poll"
+webhook_host = "0.0.0.0"
+webhook_port = 8080
+# Секрет, указанный в настройках вебхука на GitHub
+webhook_secret = ""
+
+# PR, изменения которых уже есть в потомке (перенесены вручную или раньше), не зеркалируются.
+# Проверка идёт по индексу git patch-id коммитов потомка в рабочем логе, индекс
+# дополняется только новыми коммитами. При первом построении берутся последние коммиты
+skip_applied_changes = True
+patch_index_max_commits = 10000
+# В частичном клоне (clone_strategy = "blobless") git log -p загружает содержимое каждого
+# файла отдельным запросом, поэтому индексируется не больше стольких новых коммитов.
+# 0 - индекс в частичном клоне не строится
+patch_index_partial_max_commits = 200
+
+# Ветки нескольких PR отправляются одним git push. При push_atomic = True они попадают
+# в потомка все вместе или ни одна, и при отказе GitHub все PR повторяются позже
+push_atomic = False
+
+# Фоновая загрузка в локальный клон основной ветки предка и вершин его открытых PR, чтобы
+# к моменту слияния все объекты уже были локально. Загрузка идёт с низким приоритетом
+# и пропускает проход, пока зеркалирование само загружает изменения
+prefetch_enabled = False
+prefetch_interval = 300
+# Сколько недавно обновлённых открытых PR держать загруженными
+prefetch_max_pulls = 100
+# Предел размера хранилища объектов клона в МБ. При превышении загруженные вершины PR
+# удаляются, начиная с давно обновлённых, и объекты без ссылок вычищаются. 0 - без предела
+prefetch_disk_budget_mb = 0
+
+# Пакетный режим: слитые PR собираются в течение batch_window секунд (или пока их не
+# наберётся batch_max_size) и переносятся одной веткой upstream-merge-batch-* с одним PR
+batch_mode = False
+batch_window = 600
+batch_max_size = 20
+
+# HTTP сервер метрик в формате Prometheus (/metrics). 0 - сервер не запускается
+metrics_host = "0.0.0.0"
+metrics_port = 0
+
+# Оценка количества запросов REST API на одну операцию
+operation_costs = {"poll": 1, "mirror": 3, "remirror": 2, "batch": 3, "prefetch": 1}
+# Сколько запросов держать в запасе, не расходуя на зеркалирование
+rate_limit_reserve = 10
+# Повтор неудачного зеркалирования: задержка удваивается с каждой попыткой
+retry_base_delay = 60
+retry_max_delay = 3600
+retry_max_attempts = 8
@@ -0,0 +1,66 @@
+import os
+import types
+import logging
+import importlib
+import config
+
+# Настройки, которые используются только при запуске: клиенты GitHub, клоны,
+# рабочие логи и серверы создаются один раз, поэтому их изменение требует перезапуска
+RESTART_SETTINGS = [
+    "username", "password", "api_key", "github_api_url", "github_url",
+    "upstream_owner", "upstream_repo", "downstream_owner", "downstream_repo", "mirror_pairs",
+    "local_repo_directory", "clone_strategy", "mirror_workers", "state_db_file", "work_log_file",
+    "work_log_backend", "log_file", "log_rotation", "log_max_bytes", "log_rotate_when", "log_backup_count",
+    "log_format", "prefetch_enabled", "webhook_secret", "webhook_host", "webhook_port", "metrics_host", "metrics_port"
+]
+
+
+def settings():
+    return {name: value for name, value in vars(config).items()
+            if not name.startswith("_") and not isinstance(value, types.ModuleType) and not callable(value)}
+
+
+class ConfigWatcher:
+    """
+    Перечитывает config.py, когда файл изменён. Модули обращаются к настройкам
+    через config.<имя> в момент использования, поэтому новые значения действуют
+    без повторной инициализации бота.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("log")
+        self.path = config.__file__
+        self.mtime = self.modified()
+
+    def modified(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def check(self):
+        """
+        Возвращает список изменённых настроек или пустой список, если файл не менялся.
+        """
+        mtime = self.modified()
+        if mtime is None or mtime == self.mtime:
+            return []
+        self.mtime = mtime
+        before = settings()
+        try:
+            importlib.reload(config)
+        except Exception:
+            # Ошибка в файле: возвращаем значения, которые могли успеть перезаписаться
+            vars(config).update(before)
+            self.logger.exception("Не удалось перечитать config.py, используются прежние настройки.")
+            return []
+        after = settings()
+        changed = sorted(name for name in after.keys() | before.keys() if after.get(name) != before.get(name))
+        if not changed:
+            return []
+        self.logger.setLevel(config.log_level)
+        self.logger.info(f"Настройки перечитаны: {', '.join(changed)}.")
+        restart = [name for name in changed if name in RESTART_SETTINGS]
+        if restart:
+            self.logger.warning(f"Изменение {', '.join(restart)} вступит в силу после перезапуска.")
+        return changed
@@ -0,0 +1,95 @@
+import logging
+import config
+
+
+class EventCursor:
+    """
+    Положение в лентах событий репозиториев: последнее обработанное событие, ETag
+    и число страниц. Живёт дольше одного потока событий, поэтому перезапуск
+    потока продолжает чтение с того же места, а рабочие логи пар, в которые входит
+    репозиторий, сохраняют его между запусками вместе с окном обработанных событий.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("log")
+        self.last_seen_ids = {}
+        self.etags = {}
+        self.page_counts = {}
+        # События, дочитанные при запуске и ещё не переданные потоку
+        self.pending = {}
+        # Результаты resume: удалось ли дочитать ленту без пропусков
+        self.resumed = {}
+        self.stores = {}
+
+    def attach(self, repo, store):
+        """
+        Сохранять положение ленты repo в рабочем логе store.
+        """
+        stores = self.stores.setdefault(repo.html_url, [])
+        if store not in stores:
+            stores.append(store)
+
+    def stored_id(self, repo):
+        """
+        Возвращает (последнее событие, ETag) из рабочих логов. Если положение сохранено
+        не во всех логах, возвращает None, а из нескольких сохранённых берёт самое раннее.
+        """
+        rows = [store.get_event_cursor(repo.html_url) for store in self.stores.get(repo.html_url, [])]
+        if not rows or None in rows:
+            return None
+        return min(rows, key=lambda row: row[0])
+
+    def resume(self, client, repo):
+        """
+        Дочитывает ленту repo с сохранённого положения. Возвращает True, если все
+        события после него ещё есть в ленте, и False, если положение не сохранено или
+        устарело: тогда пропущенные слияния нужно искать по списку PR.
+        """
+        if repo.html_url in self.resumed:
+            return self.resumed[repo.html_url]
+        if repo.html_url in self.last_seen_ids:
+            return True
+        stored = self.stored_id(repo)
+        if stored is None:
+            return False
+        last_seen_id, etag = stored
+        events, poll = client.poll_events(repo.full_name, last_seen_id, etag)
+        self.last_seen_ids[repo.html_url] = last_seen_id
+        self.etags[repo.html_url] = poll.etag
+        self.page_counts[repo.html_url] = poll.total_pages
+        self.pending[repo.html_url] = events
+        self.resumed[repo.html_url] = poll.not_modified or poll.reached_seen
+        if self.resumed[repo.html_url]:
+            self.logger.info(f"Лента {repo.full_name} дочитана с сохранённого положения: {len(events)} событий.")
+        else:
+            self.logger.warning(f"Сохранённое положение ленты {repo.full_name} вышло за пределы ленты событий.")
+        return self.resumed[repo.html_url]
+
+    def start(self, client, repos):
+        """
+        Запоминает текущее положение лент, которые ещё не читались и не были сохранены.
+        """
+        for repo in repos:
+            self.resume(client, repo)
+            if repo.html_url in self.last_seen_ids:
+                continue
+            events, poll = client.poll_events(repo.full_name, None, max_pages=1)
+            self.last_seen_ids[repo.html_url] = max((int(e.id) for e in events), default=0)
+            self.etags[repo.html_url] = poll.etag
+            self.page_counts[repo.html_url] = poll.total_pages
+            self.save(repo)
+
+    def take_pending(self, repo):
+        return self.pending.pop(repo.html_url, [])
+
+    def is_seen(self, repo, event):
+        return any(store.is_event_seen(repo.html_url, int(event.id)) for store in self.stores.get(repo.html_url, []))
+
+    def handled(self, repo, event):
+        for store in self.stores.get(repo.html_url, []):
+            store.add_seen_event(repo.html_url, int(event.id))
+
+    def save(self, repo):
+        for store in self.stores.get(repo.html_url, []):
+            store.set_event_cursor(repo.html_url, self.last_seen_ids[repo.html_url], self.etags.get(repo.html_url),
+                                   config.event_dedupe_window)
@@ -0,0 +1,126 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+import config
+import metrics
+from gitcmd import run_git, git_output
+
+# Обновление ссылок в общем хранилище объектов выполняется одним рабочим за раз
+fetch_lock = threading.Lock()
+
+
+def has_commit(workdir, sha):
+    return run_git(workdir, "cat-file", "-e", f"{sha}^{{commit}}").returncode == 0
+
+
+def is_shallow(workdir):
+    return git_output(workdir, "rev-parse", "--is-shallow-repository") == "true"
+
+
+def is_partial(workdir):
+    """
+    Частичный клон: недостающее содержимое файлов загружается с удалённого репозитория по запросу.
+    """
+    output = run_git(workdir, "config", "--get-regexp", r"^remote\..*\.promisor$").stdout.decode()
+    return any(line.split()[-1] == "true" for line in output.splitlines())
+
+
+def clone_arguments(strategy, last_activation_day=None):
+    """
+    Возвращает дополнительные аргументы git clone для выбранной стратегии:
+    "full" - полный клон, "blobless" - частичный клон без содержимого файлов,
+    "shallow" - история потомка начиная с последней активации.
+    """
+    if strategy == "full":
+        return []
+    if strategy == "blobless":
+        return ["--filter=blob:none"]
+    if strategy == "shallow":
+        since = last_activation_day or (datetime.now(timezone.utc) - timedelta(days=config.shallow_since_days)
+                                        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return [f"--shallow-since={since}", "--no-single-branch"]
+    raise ValueError(f"Неизвестная стратегия клонирования: {strategy}")
+
+
+def configure_remote(workdir, remote, strategy):
+    """
+    В частичном клоне дополнительные удалённые репозитории тоже помечаются как
+    источники недостающих объектов, чтобы fetch не загружал содержимое файлов.
+    """
+    if strategy != "blobless":
+        return
+    run_git(workdir, "config", f"remote.{remote}.promisor", "true", check=True)
+    run_git(workdir, "config", f"remote.{remote}.partialclonefilter", "blob:none", check=True)
+
+
+def missing_parents(workdir, pulls):
+    """
+    Возвращает коммиты, родители которых отрезаны границей неглубокой истории.
+    Для переноса нужен родитель коммита слияния, а для PR, влитых перемоткой, -
+    родители всех коммитов PR.
+    """
+    missing = []
+    for pull in pulls:
+        shas = [pull.merge_commit_sha]
+        if pull.commits:
+            shas += [commit.sha for commit in pull.commits]
+        for sha in shas:
+            if sha and has_commit(workdir, sha) and not has_commit(workdir, f"{sha}^1"):
+                missing.append(sha)
+    return missing
+
+
+def deepen_for_pulls(workdir, pulls):
+    """
+    Догружает историю неглубокого клона, пока у нужных коммитов не появятся родители.
+    """
+    logger = logging.getLogger("log")
+    depth = config.shallow_fetch_depth
+    for attempt in range(config.deepen_attempts):
+        missing = missing_parents(workdir, pulls)
+        if not missing:
+            return
+        depth *= 2
+        logger.debug(f"Углубление истории до {depth} коммитов для {len(missing)} коммитов.")
+        run_git(workdir, "fetch", "--no-tags", f"--depth={depth}", "upstream", *missing)
+    if missing_parents(workdir, pulls):
+        logger.warning("Не удалось загрузить историю, необходимую для переноса PR.")
+
+
+def plan_fetch(workdir, pulls):
+    """
+    Возвращает коммиты слияния PR, которых ещё нет в локальном хранилище.
+    Родители и коммиты PR достижимы из коммита слияния и приходят вместе с ним.
+    """
+    missing = []
+    for pull in pulls:
+        sha = pull.merge_commit_sha
+        if sha and sha not in missing and not has_commit(workdir, sha):
+            missing.append(sha)
+    return missing
+
+
+def fetch_for_pulls(workdir, pulls, refresh_base=True):
+    """
+    Загружает только то, что нужно для переноса PR: master потомка и недостающие
+    коммиты слияния предка, всё одним запуском git fetch на удалённый репозиторий.
+    """
+    logger = logging.getLogger("log")
+    shallow = is_shallow(workdir)
+    with fetch_lock, metrics.timed("fetch"):
+        if refresh_base:
+            logger.debug("Обновление downstream/master.")
+            run_git(workdir, "fetch", "downstream", "master")
+        missing = plan_fetch(workdir, pulls)
+        if missing:
+            logger.debug(f"Загрузка {len(missing)} коммитов из upstream.")
+            # В неглубоком клоне загружается только коммит слияния с родителями
+            depth = [f"--depth={config.shallow_fetch_depth}"] if shallow else []
+            result = run_git(workdir, "fetch", "--no-tags", *depth, "upstream", *missing)
+            if result.returncode != 0:
+                logger.warning("Не удалось загрузить коммиты по хешу, загрузка upstream целиком.")
+                run_git(workdir, "fetch", *depth, "upstream")
+        else:
+            logger.debug("Все коммиты PR уже есть локально.")
+        if shallow:
+            deepen_for_pulls(workdir, pulls)
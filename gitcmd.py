@@ -0,0 +1,45 @@
+import subprocess
+import tracing
+
+
+def run_git(workdir, *args, check=False, env=None, input=None, prefix=()):
+    """
+    Запускает git и возвращает CompletedProcess с выводом в stdout и stderr.
+    Длительность команды попадает в трассу PR как этап git.
+    prefix - команды перед git, например nice для фоновой работы.
+    """
+    with tracing.span("git", command=args[0]) as fields:
+        result = subprocess.run([*prefix, "git", *args], cwd=workdir, env=env, input=input,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        fields["returncode"] = result.returncode
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return result
+
+
+def git_output(workdir, *args, env=None):
+    """
+    Возвращает вывод git без пробелов по краям. При ошибке бросает CalledProcessError.
+    """
+    return run_git(workdir, *args, env=env, check=True).stdout.decode().strip()
+
+
+def pipe_git(workdir, source_args, *args):
+    """
+    Передаёт вывод git source_args на вход git args по каналу, не собирая его в памяти.
+    Возвращает CompletedProcess второй команды, при ошибке любой из них бросает CalledProcessError.
+    """
+    with tracing.span("git", command=f"{source_args[0]} | {args[0]}") as fields:
+        source = subprocess.Popen(["git", *source_args], cwd=workdir, stdout=subprocess.PIPE)
+        try:
+            result = subprocess.run(["git", *args], cwd=workdir, stdin=source.stdout,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+            source.stdout.close()
+            source.wait()
+        fields["returncode"] = source.returncode or result.returncode
+    if source.returncode:
+        raise subprocess.CalledProcessError(source.returncode, source.args)
+    if result.returncode:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    return result
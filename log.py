@@ -1,32 +1,116 @@
+import copy
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
+from datetime import datetime, timezone
 import config
+import tracing
+
+
+class TraceFilter(logging.Filter):
+    """
+    Добавляет к записи trace id и номер PR из текущей трассы.
+    Работает в потоке, который пишет в лог, до передачи записи в очередь.
+    """
+
+    def filter(self, record):
+        trace = tracing.current.get()
+        record.trace_id, record.pr = trace if trace else (None, None)
+        record.trace = f" [#{record.pr} {record.trace_id}]" if trace else ""
+        return True
+
+
+class ConsoleFilter(logging.Filter):
+    # Записи о длительности этапов пишутся только в файл
+    def filter(self, record):
+        return not record.name.startswith("log.trace")
+
+
+class TraceQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который оставляет текст исключения отдельно от сообщения,
+    чтобы JSON формат мог записать его в своё поле.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "level": record.levelname,
+            "module": record.module,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+            entry["pr"] = record.pr
+        if getattr(record, "span", None):
+            entry["span"] = record.span
+            entry["duration"] = record.duration
+            entry.update(record.fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def file_handler(path):
+    if config.log_rotation == "size":
+        return logging.handlers.RotatingFileHandler(path, maxBytes=config.log_max_bytes,
+                                                    backupCount=config.log_backup_count, encoding='utf-8')
+    if config.log_rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(path, when=config.log_rotate_when,
+                                                         backupCount=config.log_backup_count, encoding='utf-8')
+    return logging.FileHandler(path, encoding='utf-8')
+
 
 def make_logger(name):
-    formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    """
+    Записи складываются в очередь, а в консоль и файл их пишет отдельный поток,
+    поэтому медленный диск не задерживает зеркалирование.
+    """
+    formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s -%(trace)s %(message)s')
 
     shandler = logging.StreamHandler()
     shandler.setFormatter(formatter)
+    shandler.addFilter(ConsoleFilter())
 
     # Попытка создать файловый обработчик
     try:
-        if config.log_file:
-            fhandler = logging.FileHandler(config.log_file, encoding='utf-8')
-        else:
-            fhandler = logging.FileHandler("mirror.log", encoding='utf-8')
+        fhandler = file_handler(config.log_file or "mirror.log")
     except Exception as e:
         # Если не удалось создать файловый обработчик, логируем ошибку через консоль и используем альтернативный обработчик
         shandler.emit(logging.makeLogRecord({
             'msg': f'Не удалось создать файловый обработчик. Используем консоль для логирования. Ошибка: {e}',
             'levelno': logging.ERROR,
-            'levelname': 'ERROR'
+            'levelname': 'ERROR',
+            'trace': ''
         }))
         fhandler = logging.StreamHandler()
-    
-    fhandler.setFormatter(formatter)
+
+    fhandler.setFormatter(JsonFormatter() if config.log_format == "json" else formatter)
+
+    log_queue = queue.SimpleQueue()
+    qhandler = TraceQueueHandler(log_queue)
+    qhandler.addFilter(TraceFilter())
+    listener = logging.handlers.QueueListener(log_queue, shandler, fhandler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
     logger = logging.getLogger(name)
     logger.setLevel(config.log_level)
-    logger.addHandler(shandler)
-    logger.addHandler(fhandler)
-    
-    return logger
\ No newline at end of file
+    logger.addHandler(qhandler)
+
+    return logger
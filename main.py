@@ -4,16 +4,29 @@ import config
 import os
 import subprocess
 import tools
-from mirror import Mirror
+import pairs
+import metrics
+from mirror import MirrorGroup
+from async_engine import AsyncEngine
 from datetime import datetime, timezone
 from github import Github
 
 logger = log.make_logger("log")
 logger.info("Запуск.")
 
-mirror = Mirror()
+mirror = MirrorGroup(pairs.load_pairs())
+
+if config.metrics_port:
+	metrics.start_server(config.metrics_host, config.metrics_port)
+
+mirror.initialize()
 
 while True:
-	mirror.initialize()
-	mirror.run()
+	mirror.refresh()
+	if config.engine == "async":
+		AsyncEngine(mirror).run()
+	elif config.event_source == "webhook":
+		mirror.listen()
+	else:
+		mirror.run()
 
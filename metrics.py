@@ -0,0 +1,172 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tracing
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    def __init__(self, name, documentation, kind, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, "counter", labels)
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return self.header() + [f"{self.name}{self.label_text(key)} {value}"
+                                    for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """
+    Значение задаётся через set или вычисляется при каждом запросе функциями,
+    переданными в set_callback. Функция возвращает словарь метки -> значение.
+    """
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, "gauge", labels)
+        self.values = {}
+        self.callbacks = {}
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def set_callback(self, source, callback):
+        """
+        source - имя источника значений; повторная регистрация заменяет прежнюю функцию.
+        """
+        with self.lock:
+            self.callbacks[source] = callback
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+            callbacks = list(self.callbacks.values())
+        for callback in callbacks:
+            try:
+                values.update(callback())
+            except Exception:
+                logging.getLogger("log").exception(f"Ошибка при вычислении метрики {self.name}.")
+        return self.header() + [f"{self.name}{self.label_text(key)} {value}"
+                                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    def __init__(self, name, documentation, labels=(), buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)):
+        super().__init__(name, documentation, "histogram", labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам, сумма, количество наблюдений]
+        self.values = {}
+        # Функции, получающие каждое наблюдение целиком, например для подсчёта процентилей
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def observe(self, value, *label_values):
+        for listener in self.listeners:
+            listener(value, *label_values)
+        with self.lock:
+            counts, total, observations = self.values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+            counts = [count + (value <= bound) for count, bound in zip(counts, self.buckets)]
+            self.values[label_values] = (counts, total + value, observations + 1)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, (counts, total, observations) in sorted(self.values.items()):
+                for count, bound in zip(counts, self.buckets):
+                    lines.append(f"{self.name}_bucket{self.label_text(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{self.label_text(key, [('le', '+Inf')])} {observations}")
+                lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+                lines.append(f"{self.name}_count{self.label_text(key)} {observations}")
+        return lines
+
+
+phase_seconds = Histogram("mirror_phase_seconds", "Время этапов зеркалирования PR.", ["phase"])
+api_calls = Counter("github_api_calls_total", "Запросы к GitHub API.", ["api", "endpoint"])
+queue_depth = Gauge("mirror_queue_depth", "Глубина бэклога, очереди планировщика и очередей асинхронного движка.", ["pair", "queue"])
+event_lag = Gauge("mirror_event_lag_seconds", "Время от слияния PR предка до создания PR зеркала.", ["pair"])
+rate_limit_remaining = Gauge("github_rate_limit_remaining", "Оставшаяся квота GitHub API по видам (core, graphql).",
+                             ["resource"])
+
+registry = [phase_seconds, api_calls, queue_depth, event_lag, rate_limit_remaining]
+
+
+@contextmanager
+def timed(phase):
+    start = time.monotonic()
+    try:
+        with tracing.span(phase):
+            yield
+    finally:
+        phase_seconds.observe(time.monotonic() - start, phase)
+
+
+def seconds_since(timestamp):
+    """
+    Принимает дату GitHub строкой ISO 8601 (GraphQL) или datetime (PyGithub).
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - timestamp).total_seconds()
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def start_server(host, port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.getLogger("log").info(f"Метрики доступны на {host}:{server.server_address[1]}/metrics.")
+    return server
@@ -1,312 +1,1025 @@
+import re
 import sys
 import logging
 import config
 import os
-import subprocess
 import tools
+import api
+import webhook
+import worktree
+import fetch
+import scheduler
+import object_apply
+import push
+import patch_index
+import prefetch
+import progress
+import tracing
+import config_reload
+import event_cursor
+import metrics
 import time
+import threading
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from github import Github
+from gitcmd import run_git, git_output
 
 
-class Mirror:
-    def __init__(self):
+class MirrorGroup:
+    """
+    Все зеркалируемые пары репозиториев одного процесса.
+    Пары используют общие клиенты GitHub, а лента событий каждого репозитория
+    опрашивается один раз и раздаётся всем парам, в которые он входит.
+    """
+
+    def __init__(self, pairs):
         self.logger = logging.getLogger("log")
-        self.last_activation_day = None
+        self.mirrors = [Mirror(pair) for pair in pairs]
         self.github_api = None
-        self.upstream = None
-        self.downstream = None
+        self.client = None
+        self.repos = {}
+        self.cursor = event_cursor.EventCursor()
+        self.watcher = config_reload.ConfigWatcher()
 
     def initialize(self):
+        """
+        Однократная подготовка при запуске: вход в GitHub, получение репозиториев,
+        клоны, рабочие логи и разбор бэклога. Основной цикл затем только вызывает refresh.
+        """
         self.logger.info("Инициализация бота.")
         # Проверяем корректность данных для входа.
         try:
             if config.username and config.password:
-                self.github_api = Github(config.username, config.password)
+                self.github_api = Github(config.username, config.password, base_url=config.github_api_url)
             elif config.api_key:
-                self.github_api = Github(config.api_key)
+                self.github_api = Github(config.api_key, base_url=config.github_api_url)
             else:
                 self.exit_with_error("Не указано имя пользователя/пароль или API-ключ для GitHub в настройках.")
         except Exception as e:
             self.exit_with_error("Ошибка при входе в GitHub, проверьте правильность данных или попробуйте позже.")
 
+        self.client = api.GithubClient(config.github_api_url)
+        self.repos = {}
+        # Рабочие логи всех пар подключаются к ленте до её дочитывания, чтобы
+        # дочитывание началось с самого раннего положения, сохранённого парами
+        for mirror in self.mirrors:
+            mirror.connect(self.github_api, self.client, self.get_repo, self.cursor)
+        for mirror in self.mirrors:
+            mirror.initialize(self.cursor)
+        metrics.queue_depth.set_callback("store", self.queue_depths)
+        metrics.rate_limit_remaining.set_callback("github", self.requests_left)
+
+    def refresh(self):
+        """
+        Дешёвая проверка между итерациями: подхватывает изменения config.py и
+        обновляет дату последнего включения пар.
+        """
+        self.watcher.check()
+        for mirror in self.mirrors:
+            mirror.refresh_activation_day()
+
+    def queue_depths(self):
+        depths = {}
+        for mirror in self.mirrors:
+            depths[(str(mirror.pair), "backlog")] = len(tools.get_processing_prs(mirror.store))
+            depths[(str(mirror.pair), "scheduler")] = mirror.store.count_tasks()
+        return depths
+
+    def requests_left(self):
+        # Квота общая для всех пар; REST запросы PyGithub учитываются в core
+        requests_left, _ = self.mirrors[0].rate_budget()
+        quotas = {(resource,): remaining for resource, (remaining, _) in self.client.quotas.items()}
+        if requests_left is not None:
+            quotas[("core",)] = requests_left
+        return quotas
+
+    def get_repo(self, full_name):
+        if full_name.lower() not in self.repos:
+            metrics.api_calls.inc("rest", "/repos/{owner}/{repo}")
+            self.repos[full_name.lower()] = self.github_api.get_repo(full_name)
+        return self.repos[full_name.lower()]
+
+    def run(self):
+        self.logger.info("Движок зеркалирования запущен.")
+        try:
+            for repo, event in self.poll_events():
+                self.dispatch(repo, event)
+        except Exception as e:
+            self.logger.exception("Ошибка при получении событий из GitHub.")
+
+    def listen(self):
+        """
+        Принимает события через вебхуки вместо опроса ленты событий.
+        """
+        self.logger.info("Движок зеркалирования запущен в режиме вебхуков.")
+        for repo, event in self.webhook_events():
+            self.dispatch(repo, event)
+
+    def dispatch(self, repo, event):
+        for mirror in self.mirrors_of(repo):
+            mirror.handle_event(repo, event)
+
+    def mirrors_of(self, repo):
+        full_name = repo.full_name.lower()
+        return [mirror for mirror in self.mirrors
+                if full_name in (mirror.upstream.full_name.lower(), mirror.downstream.full_name.lower())]
+
+    def webhook_events(self, run_pending=True):
+        if not config.webhook_secret:
+            self.exit_with_error("Для приёма вебхуков необходимо указать webhook_secret в конфигурации.")
+        receiver = webhook.WebhookReceiver(config.webhook_secret, config.webhook_host, config.webhook_port)
+        receiver.start()
+        try:
+            for delivery in receiver.events(timeout=config.event_stream_wait):
+                if delivery is None:
+                    # Повторы, отложенные задачи и пакеты выполняются и в отсутствие вебхуков
+                    if run_pending:
+                        self.run_pending()
+                    else:
+                        self.refresh()
+                    continue
+                self.refresh()
+                full_name, event = delivery
+                repo = self.repos.get(full_name.lower())
+                if repo is None:
+                    self.logger.warning(f"Получен вебхук для неизвестного репозитория {full_name}. Пропуск.")
+                    continue
+                yield repo, event
+        finally:
+            receiver.stop()
+
+    def poll_events(self, run_pending=True):
+        return github_event_stream(
+            self.client,
+            list(self.repos.values()),
+            ["PullRequestEvent", "IssueCommentEvent"],
+            [mirror.scheduler for mirror in self.mirrors],
+            run_pending,
+            self.cursor,
+            self.refresh
+        )
+
+    def run_pending(self):
+        self.refresh()
+        for mirror in self.mirrors:
+            mirror.scheduler.run_pending()
+
+    def exit_with_error(self, message, fatal=True):
+        self.logger.critical(message)
+        if fatal:
+            sys.exit(1)
+
+
+class Mirror:
+    def __init__(self, pair):
+        self.logger = logging.getLogger("log")
+        self.pair = pair
+        self.last_activation_day = None
+        self.github_api = None
+        self.upstream = None
+        self.downstream = None
+        self.client = None
+        self.store = None
+        self.pool = None
+        self.scheduler = None
+        # PR, ожидающие переноса в пакетном режиме
+        self.batch = []
+        self.batch_lock = threading.Lock()
+        # Данные PR бэклога, уже полученные при запуске
+        self.known_pulls = None
+        # Время, которое станет датой последнего включения при следующем обновлении
+        self.activation_checkpoint = None
+        self.activation_checked = 0
+        self.prefetcher = None
+
+    def connect(self, github_api, client, get_repo, cursor):
+        """
+        Открывает рабочий лог пары, получает её репозитории и подключает лог к ленте событий.
+        """
+        pair = self.pair
+        self.logger.info(f"Инициализация пары {pair}.")
+        self.github_api = github_api
+        self.client = client
+        self.store = tools.get_store(pair.state_db_file, pair.work_log_file)
+        self.scheduler = scheduler.Scheduler(self.store, self.rate_budget, {
+            "remirror": self.remirror_task,
+            "batch": self.batch_task
+        }, {
+            "mirror": self.mirror_tasks
+        })
+
         try:
-            self.upstream = self.github_api.get_repo(
-                f"{config.upstream_owner}/{config.upstream_repo}")
+            self.upstream = get_repo(pair.upstream_name)
         except:
             self.exit_with_error("Ошибка при получении информации о исходном репозитории, убедитесь, что указаны правильные имя владельца и название репозитория.")
 
         try:
-            self.downstream = self.github_api.get_repo(
-                f"{config.downstream_owner}/{config.downstream_repo}")
+            self.downstream = get_repo(pair.downstream_name)
         except:
             self.exit_with_error("Ошибка при получении информации о целевом репозитории, убедитесь, что указаны правильные имя владельца и название репозитория.")
 
-        local_dir = config.local_repo_directory
+        cursor.attach(self.upstream, self.store)
+        cursor.attach(self.downstream, self.store)
 
-        if not local_dir:
-            self.exit_with_error("Папка локального репозитория не настроена в конфигурации.")
+    def initialize(self, cursor):
+        pair = self.pair
+        local_dir = pair.local_repo_directory
 
-        if not config.local_repo_directory:
+        if not local_dir:
             self.exit_with_error("Каталог локального репозитория не задан в конфигурации.")
 
-        if os.path.isdir(config.local_repo_directory) and not os.path.isdir(f"{config.local_repo_directory}/.git"):
+        if os.path.isdir(local_dir) and not os.path.isdir(f"{local_dir}/.git"):
             self.exit_with_error("Каталог локального репозитория уже существует и не является репозиторием git..")
 
-        if not os.path.isdir(config.local_repo_directory):
+        if not os.path.isdir(local_dir):
             self.logger.warning(
 				"Локальный клон потомка не найден, клонирование.")
             try:
-                subprocess.check_output(
-					["git", "clone", f"https://github.com/{config.downstream_owner}/{config.downstream_repo}", f"{config.local_repo_directory}"])
-                current_directory = os.getcwd()
-                os.chdir(config.local_repo_directory)
-                subprocess.check_output(["git", "remote", "add", "upstream",
-                                    f"https://github.com/{config.upstream_owner}/{config.upstream_repo}"])
-                subprocess.check_output(["git", "remote", "add", "downstream",
-                                    f"https://github.com/{config.downstream_owner}/{config.downstream_repo}"])
-                os.chdir(current_directory)
+                clone_arguments = fetch.clone_arguments(config.clone_strategy, tools.get_last_activation_day(self.store))
+                run_git(None, "clone", *clone_arguments, f"{config.github_url}/{pair.downstream_name}", local_dir,
+                        check=True)
+                run_git(local_dir, "remote", "add", "upstream", f"{config.github_url}/{pair.upstream_name}",
+                        check=True)
+                run_git(local_dir, "remote", "add", "downstream", f"{config.github_url}/{pair.downstream_name}",
+                        check=True)
+                for remote in ["upstream", "downstream"]:
+                    fetch.configure_remote(local_dir, remote, config.clone_strategy)
             except:
                 self.exit_with_error("Во время клонирования произошла ошибка.")
 
-        if tools.is_gh_installed():
-            if not tools.is_gh_logged():
-                self.exit_with_error("Авторизация в GitHub CLI не выполнена, выполните авторизацию вручную для продолжения.")
-        else:
-            self.exit_with_error("GitHub CLI не обнаружена в системе.")
+        self.pool = worktree.WorktreePool(local_dir, pair.mirror_workers)
+        try:
+            self.pool.prepare()
+        except:
+            self.exit_with_error("Не удалось подготовить рабочие каталоги для зеркалирования.")
+
+        if config.prefetch_enabled and self.prefetcher is None:
+            self.prefetcher = prefetch.Prefetcher(local_dir, self.client, pair.upstream_owner, pair.upstream_repo,
+                                                  self.scheduler.has_budget)
+            self.prefetcher.start()
+
+        try:
+            progress.recover(self.store, self.downstream, local_dir)
+        except Exception:
+            self.logger.exception("Не удалось сверить состояние незавершённых PR с потомком.")
 
-        if config.work_log_file:
-            if not os.path.exists(config.work_log_file):
-                self.last_activation_day = datetime.now(
-                    timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-                tools.initialize_work_log(self.last_activation_day)
+        if pair.state_db_file:
+            self.activation_checkpoint = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            self.activation_checked = time.time()
+            if not tools.work_log_exists(self.store):
+                self.last_activation_day = self.activation_checkpoint
+                tools.initialize_work_log(self.store, self.last_activation_day)
                 self.logger.info("Первичная инициализация рабочего файла.")
             else:
-                self.last_activation_day = tools.get_last_activation_day()
-                tools.update_activation_day(datetime.now(
-                    timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"))
+                self.last_activation_day = tools.get_last_activation_day(self.store)
+                tools.update_activation_day(self.store, self.activation_checkpoint)
                 self.logger.info(
                     f"Дата последнего включения: {self.last_activation_day}")
-                new_prs = []
-                if (config.depth_pr_check):
-                    new_prs = tools.get_last_merged_prs(f"{config.upstream_owner}/{config.upstream_repo}",
-                                                        self.last_activation_day,
-                                                        config.depth_pr_check)
-                else:
-                    self.logger.warn(
-                        "Не указана глубина PR для извлечения из репозитория родителя.")
-                    new_prs = tools.get_last_merged_prs(f"{config.upstream_owner}/{config.upstream_repo}",
-                                                        self.last_activation_day)
+                try:
+                    if self.resume_events(cursor):
+                        # Слияния за время простоя придут из ленты событий
+                        new_prs = []
+                    else:
+                        new_prs = tools.get_last_merged_prs(self.client, self.store, pair.upstream_owner,
+                                                            pair.upstream_repo, self.last_activation_day)
+                except Exception:
+                    self.logger.exception("Ошибка при получении списка слитых PR.")
+                    self.exit_with_error("Не удалось получить список PR, слитых за время простоя.")
                 if (new_prs):
-                    tools.add_processing_prs(new_prs)
-                processing_prs = tools.get_processing_prs()
+                    tools.add_processing_prs(self.store, [pull.number for pull in new_prs])
+                processing_prs = tools.get_processing_prs(self.store)
                 if (processing_prs):
-                    for pr_number in reversed(processing_prs):
-                        mirror_pr(self.upstream, self.downstream, pr_number)
+                    backlog = list(reversed(processing_prs))
+                    if config.batch_mode:
+                        self.batch = []
+                        for pr_number in backlog:
+                            self.add_to_batch(pr_number, delay=0)
+                        self.known_pulls = {pull.number: pull for pull in new_prs}
+                        self.scheduler.run_pending()
+                        failed = []
+                    elif self.scheduler.has_budget("mirror", len(backlog)):
+                        results = mirror_prs(self.client, self.upstream, self.downstream, backlog, self.pool,
+                                             self.store, known_pulls={pull.number: pull for pull in new_prs})
+                        failed = [pr_number for pr_number, result in zip(backlog, results) if not result]
+                    else:
+                        self.logger.warning("Квоты GitHub API не хватает на весь бэклог, PR поставлены в очередь.")
+                        failed = backlog
+                    for pr_number in failed:
+                        self.scheduler.submit("mirror", pr_number, fresh=False)
         else:
             self.exit_with_error("В конфигируации отсуствует папка для работы с рабочими логами")
         return
 
-    def run(self):
-        self.logger.info("Движок зеркалирования запущен.")
+    def refresh_activation_day(self):
+        """
+        Раз в activation_day_interval секунд записывает в рабочий лог время прошлого
+        обновления: все слияния до него уже пришли из ленты событий или вебхуков.
+        """
+        if self.activation_checkpoint is None or time.time() - self.activation_checked < config.activation_day_interval:
+            return
+        tools.update_activation_day(self.store, self.activation_checkpoint)
+        self.activation_checkpoint = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.activation_checked = time.time()
+
+    def resume_events(self, cursor):
+        """
+        Дочитывает ленту предка с положения, сохранённого в рабочем логе пары.
+        Возвращает False, если положения нет или оно устарело, а также при приёме
+        вебхуков: ленту тогда никто не читает, и дочитанные события не были бы переданы.
+        """
+        if config.event_source == "webhook":
+            return False
+        if self.store.get_event_cursor(self.upstream.html_url) is None:
+            return False
         try:
-            for repo, event in github_event_stream(
-                self.github_api,
-                [self.upstream, self.downstream],
-                ["PullRequestEvent", "IssueCommentEvent"]
-            ):
-                try:
-                    if event.type == "PullRequestEvent" and repo == self.upstream:
-                        self.logger.debug("Обработка события PR.")
-                        if event.payload.get("action") == "closed" and event.payload["pull_request"].get("merged"):
-                            self.logger.info("Обработка слияния Pull Request.")
-                            
-                            pr_number = int(event.payload["pull_request"]["number"])
-                            if not tools.check_processed_pr(pr_number):
-                                tools.add_processing_pr(pr_number)
-                                # Проверка на лимит запросов
-                                requests_left, _ = self.github_api.rate_limiting
-                                if requests_left < 10:
-                                    self.logger.warning("Мало оставшихся запросов к GitHub API. Пропуск зеркалирования.")
-                                    continue
-
-                                result = mirror_pr(self.upstream, self.downstream, pr_number)
-
-                                requests_left_after, _ = self.github_api.rate_limiting
-                                self.logger.info(
-                                    f"Выполнено {requests_left - requests_left_after} запросов ({requests_left_after} осталось)"
-                                )
-                            else:
-                                self.logger.info(f"PR {pr_number} уже был отработан. Пропуск") 
-    
-                    elif event.type == "IssueCommentEvent" and repo == self.downstream:
-                        self.logger.debug("Обработка комментария.")
-                        if event.payload.get("action") != "created":
-                            continue  # Не удаляем цикл из-за return
-                        
-                        comment_user = event.payload["comment"]["user"]["login"]
-                        comment_body = event.payload["comment"]["body"]
-                        action = comment_body.strip().split()[0].lower()
-                        self.logger.debug(f"Пользователь: {comment_user}, Действие: {action}")
-    
-                        if action.startswith("remirror"):
-                            association = event.payload["comment"]["author_association"]
-                            if association not in ["MEMBER", "OWNER"]:
-                                repo.get_comment(event.payload["comment"]["id"]).create_reaction("-1")
-                                self.logger.warning("Пользователь не имеет прав на remirror.")
-                                continue
-                            
-                            pr_number = event.payload["issue"]["number"]
-                            remirror_pr(self.upstream, self.downstream, pr_number)
-    
-                except Exception as inner_event_error:
-                    self.logger.exception(f"Ошибка при обработке одного из событий GitHub: {inner_event_error}")
-    
-        except Exception as e:
-            self.logger.exception("Ошибка при получении событий из GitHub.")
-    
+            return cursor.resume(self.client, self.upstream)
+        except Exception:
+            self.logger.exception("Не удалось дочитать ленту событий предка.")
+            return False
+
+    def handle_event(self, repo, event):
+        try:
+            if event.type == "PullRequestEvent" and repo.full_name == self.upstream.full_name:
+                self.logger.debug("Обработка события PR.")
+                if event.payload.get("action") == "closed" and event.payload["pull_request"].get("merged"):
+                    self.logger.info("Обработка слияния Pull Request.")
+
+                    pr_number = int(event.payload["pull_request"]["number"])
+                    if not tools.check_processed_pr(self.store, pr_number):
+                        tools.add_processing_pr(self.store, pr_number)
+                        if config.batch_mode:
+                            self.add_to_batch(pr_number)
+                        else:
+                            self.scheduler.submit("mirror", pr_number)
+                        # При опросе ленты задачи выполняет поток событий после всей страницы,
+                        # и слияния из неё переносятся параллельно
+                        if config.event_source == "webhook":
+                            self.scheduler.run_pending()
+                    else:
+                        self.logger.info(f"PR {pr_number} уже был отработан. Пропуск")
+
+            elif event.type == "IssueCommentEvent" and repo.full_name == self.downstream.full_name:
+                self.logger.debug("Обработка комментария.")
+                if event.payload.get("action") != "created":
+                    return
+
+                comment_user = event.payload["comment"]["user"]["login"]
+                comment_body = event.payload["comment"]["body"]
+                action = comment_body.strip().split()[0].lower()
+                self.logger.debug(f"Пользователь: {comment_user}, Действие: {action}")
+
+                if action.startswith("remirror"):
+                    association = event.payload["comment"]["author_association"]
+                    if association not in ["MEMBER", "OWNER"]:
+                        metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/issues/comments/{number}/reactions")
+                        with tracing.span("api", method="POST",
+                                          endpoint="/repos/{owner}/{repo}/issues/comments/{number}/reactions"):
+                            repo.get_comment(event.payload["comment"]["id"]).create_reaction("-1")
+                        self.logger.warning("Пользователь не имеет прав на remirror.")
+                        return
+
+                    pr_number = event.payload["issue"]["number"]
+                    self.scheduler.submit("remirror", pr_number)
+                    self.scheduler.run_pending()
+
+        except Exception as inner_event_error:
+            self.logger.exception(f"Ошибка при обработке одного из событий GitHub: {inner_event_error}")
+
+    def mirror_tasks(self, pr_numbers):
+        """
+        Переносит PR всех наступивших задач mirror параллельно, по одному на рабочий каталог пула.
+        """
+        pending = [pr_number for pr_number in pr_numbers if not tools.check_processed_pr(self.store, pr_number)]
+        if not pending:
+            return [True] * len(pr_numbers)
+        requests_left, _ = self.rate_budget()
+        results = dict(zip(pending, mirror_prs(self.client, self.upstream, self.downstream, pending,
+                                               self.pool, self.store)))
+        requests_left_after, _ = self.rate_budget()
+        self.logger.info(
+            f"Выполнено {requests_left - requests_left_after} запросов ({requests_left_after} осталось)"
+        )
+        return [results.get(pr_number, True) is not None for pr_number in pr_numbers]
+
+    def add_to_batch(self, pr_number, delay=None):
+        """
+        Добавляет PR в текущий пакет. Пакет отправляется через batch_window секунд
+        после первого PR или сразу, как только наберётся batch_max_size PR.
+        Сами PR хранятся в памяти: после перезапуска они остаются в processing_prs
+        рабочего лога и попадают в бэклог.
+        """
+        with self.batch_lock:
+            if pr_number not in self.batch:
+                self.batch.append(pr_number)
+            size = len(self.batch)
+        if delay is None:
+            delay = 0 if size >= config.batch_max_size else config.batch_window
+        self.scheduler.submit("batch", 0, delay=delay)
+
+    def batch_task(self, _):
+        with self.batch_lock:
+            pr_numbers, self.batch = self.batch, []
+        if not pr_numbers:
+            return True
+        known_pulls, self.known_pulls = self.known_pulls, None
+        failed = []
+        try:
+            for start in range(0, len(pr_numbers), config.batch_max_size):
+                chunk = pr_numbers[start:start + config.batch_max_size]
+                failed += mirror_batch(self.client, self.upstream, self.downstream, chunk, self.pool,
+                                       self.store, known_pulls)
+        except Exception:
+            # Пакет целиком возвращается в очередь и будет повторён планировщиком
+            with self.batch_lock:
+                self.batch = [pr_number for pr_number in pr_numbers
+                              if not tools.check_processed_pr(self.store, pr_number)] + self.batch
+            raise
+        for pr_number in failed:
+            self.logger.warning(f"PR #{pr_number} исключён из пакета и будет зеркалирован отдельно.")
+            self.scheduler.submit("mirror", pr_number)
+        return True
+
+    def remirror_task(self, mirror_pr_id):
+        with tracing.pull(self.downstream.full_name, mirror_pr_id), self.pool.acquire() as workdir:
+            return remirror_pr(self.upstream, self.downstream, mirror_pr_id, workdir, self.store)
+
+    def rate_budget(self):
+        """
+        Возвращает наименьший известный остаток квоты REST API (core) и время его сброса.
+        Квота GraphQL считается отдельно и в планировании не участвует.
+        """
+        requests_left, _ = self.github_api.rate_limiting
+        reset_time = self.github_api.rate_limiting_resettime
+        if self.client.requests_left is not None and self.client.requests_left < requests_left:
+            return self.client.requests_left, self.client.reset_time
+        return requests_left, reset_time
+
     def exit_with_error(self, message, fatal=True):
         self.logger.critical(message)
         if fatal:
             sys.exit(1)
 
 
-def clean_repo():
+def clean_repo(workdir):
     logger = logging.getLogger("log")
     logger.debug("Cleaning local repo.")
-    subprocess.run(["git", "fetch", "--all"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["git", "checkout", "master"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["git", "reset", "--hard", "downstream/master"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["git", "clean", "-f"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # master может быть занят другим рабочим каталогом, поэтому работаем с отсоединённым HEAD
+    run_git(workdir, "reset", "--hard")
+    run_git(workdir, "checkout", "--detach", "downstream/master")
+    run_git(workdir, "clean", "-f")
     logger.debug("Deleting branches.")
-    for deletable_branch in [line.strip().decode() for line in subprocess.check_output(["git", "branch"]).splitlines() if line != b"* master"]:
-        subprocess.run(["git", "branch", "-D", deletable_branch],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Ветки, занятые другими рабочими каталогами, git удалить не даст
+    branches = run_git(workdir, "for-each-ref", "--format=%(refname:short)", "refs/heads/",
+                       check=True).stdout.decode().splitlines()
+    for deletable_branch in [branch for branch in branches if branch != "master"]:
+        run_git(workdir, "branch", "-D", deletable_branch)
 
 
-def mirror_pr(upstream, downstream, pr_id):
+def mirror_prs(client, upstream, downstream, pr_numbers, pool, store, known_pulls=None):
+    """
+    Зеркалирует несколько PR параллельно, по одному на рабочий каталог пула.
+    Результаты записываются в рабочий лог в порядке исходного списка.
+    known_pulls - уже полученные данные PR, остальные загружаются одним пакетом заранее.
+    """
     logger = logging.getLogger("log")
-    logger.info(f"Зеркалирование PR #{pr_id}.")
-    current_directory = os.getcwd()
-    try:
-        os.chdir(config.local_repo_directory)
-        original_pull = upstream.get_pull(pr_id)
-        clean_repo()
-        subprocess.run(["git", "checkout", "-b", f"{config.mirror_branch_prefix}{pr_id}"],
-                       )
-        try:
-            cherry_out = subprocess.check_output(["git", "cherry-pick", "-m", "1",
-                                                  original_pull.merge_commit_sha], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            cherry_out = str(e.output)
+    pulls = prefetch_pulls(client, upstream, pr_numbers, known_pulls)
+    # Один fetch на весь список вместо отдельного на каждый PR
+    fetch.fetch_for_pulls(pool.repo_directory, list(pulls.values()))
+
+    # Этапы, пройденные при прошлых попытках
+    states = {pr_number: progress.get(store, pr_number) for pr_number in pr_numbers}
+    # PR, изменения которых уже есть в потомке, считаются отработанными без переноса
+    applied = {}
+    for pr_number in pr_numbers:
+        state = states[pr_number]
+        if progress.reached(state, progress.OPENED):
+            applied[pr_number] = progress.OpenedPull(pr_number, state["mirror_number"])
+        elif pr_number in pulls and not progress.reached(state, progress.APPLIED):
+            with tracing.pull(upstream.full_name, pr_number):
+                change = patch_index.skip_if_applied(pool.repo_directory, store, pulls[pr_number])
+            if change:
+                applied[pr_number] = change
+            else:
+                record_fetched(store, pulls[pr_number])
 
+    def prepare_in_pool(pr_number):
+        if pr_number not in pulls or pr_number in applied:
+            return None
+        with tracing.pull(upstream.full_name, pr_number):
+            return build_in_pool(pr_number)
+
+    def build_in_pool(pr_number):
+        built = progress.built_branch(pool.repo_directory, states[pr_number])
+        if built:
+            logger.info(f"Ветка PR #{pr_number} уже построена, продолжение с этапа {states[pr_number]['stage']}.")
+            return (pulls[pr_number], *built)
+        with pool.acquire() as workdir:
+            try:
+                logger.info(f"Зеркалирование PR #{pr_number}.")
+                branch, head, base_sha, conflicts = build_mirror_branch(workdir, pulls[pr_number])
+                progress.record(store, pr_number, progress.APPLIED, branch=branch, head=head, base_sha=base_sha,
+                                conflicts=" ".join(conflicts))
+                return pulls[pr_number], branch, head, base_sha
+            except Exception:
+                logger.exception(f"Во время зеркалирования PR #{pr_number} произошла ошибка.")
+                return None
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        prepared = list(executor.map(prepare_in_pool, pr_numbers))
+
+    # Все готовые ветки отправляются одним push, PR создаются только для отправленных
+    to_push = {ready[1]: ready[2] for pr_number, ready in zip(pr_numbers, prepared)
+               if ready and not progress.reached(states[pr_number], progress.PUSHED)}
+    landed = push.push_refs(pool.repo_directory, to_push)
+    results = []
+    for pr_number, ready in zip(pr_numbers, prepared):
+        result = applied.get(pr_number)
+        if ready and (landed.get(ready[1]) or ready[1] not in to_push):
+            original_pull, branch, _, base_sha = ready
+            progress.record(store, pr_number, progress.PUSHED)
+            with tracing.pull(upstream.full_name, pr_number):
+                try:
+                    result = open_or_find_pull(downstream, original_pull, branch, store, base_sha,
+                                               states[pr_number])
+                except Exception:
+                    logger.exception(f"Не удалось создать PR для #{pr_number}.")
+        if result:
+            tools.add_processed_pr(store, pr_number)
+        results.append(result)
+    return results
+
+
+def record_fetched(store, original_pull):
+    progress.record(store, original_pull.number, progress.FETCHED,
+                    merge_commit_sha=original_pull.merge_commit_sha, title=original_pull.title)
+
+
+def open_or_find_pull(downstream, original_pull, branch, store, base_sha, state=None):
+    """
+    Создаёт PR потомка. Если ветка была отправлена при прошлой попытке, сначала
+    ищет уже созданный PR, чтобы не получить ошибку о дубликате.
+    """
+    result = None
+    if progress.reached(state, progress.PUSHED):
+        result = progress.find_open_pull(downstream, branch)
+        if result is not None:
+            tools.add_mirror_pull(store, result.number, original_pull, branch, base_sha)
+    if result is None:
+        result = open_mirror_pull(downstream, original_pull, branch, store, base_sha,
+                                  progress.conflicts(store, original_pull.number))
+    progress.record(store, original_pull.number, progress.OPENED, mirror_number=result.number)
+    return result
+
+
+def prefetch_pulls(client, upstream, pr_numbers, known_pulls=None):
+    """
+    Собирает данные всех PR списка до начала работы с git: недостающие PR
+    запрашиваются пакетными GraphQL запросами вместо отдельного get_pull на каждый.
+    """
+    logger = logging.getLogger("log")
+    pulls = dict(known_pulls or {})
+    missing = [pr_number for pr_number in pr_numbers if pr_number not in pulls]
+    if missing:
+        owner, name = upstream.full_name.split("/")
         try:
-            cherry_out = cherry_out.decode()  # love python3
-        except:
-            pass
-
-        if "mainline was specified but commit" in cherry_out:
-            commits = original_pull.get_commits()
-            subprocess.run(["git", "fetch", "--all"],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            if original_pull.merge_commit_sha in [c.sha for c in commits]:
-                for c in commits:
-                    subprocess.run(
-                        ["git", "cherry-pick", "--no-commit", "-n", c.sha])
-                    subprocess.run(["git", "add", "-A", "."])
-                    subprocess.run(
-                        ["git", "commit", "--no-edit", "-m", c.commit.message])
-                    subprocess.run(["git", "cherry-pick", "--continue"])
+            pulls.update(client.get_pulls(owner, name, missing))
+        except Exception:
+            logger.exception("Ошибка при пакетной загрузке данных PR.")
+    for pr_number in missing:
+        if pr_number not in pulls:
+            logger.error(f"Не удалось получить PR #{pr_number}.")
+    return pulls
+
+
+def mirror_batch(client, upstream, downstream, pr_numbers, pool, store, known_pulls=None):
+    """
+    Переносит несколько PR на одну ветку upstream-merge-batch-* в порядке слияния,
+    отправляет её одним push и открывает один PR со списком исходных PR.
+    Возвращает номера PR, которые не удалось получить или перенести без конфликтов:
+    их нужно зеркалировать по одному.
+    """
+    logger = logging.getLogger("log")
+    pulls = prefetch_pulls(client, upstream, pr_numbers, known_pulls)
+    missing = [pr_number for pr_number in pr_numbers if pr_number not in pulls]
+    ordered = sorted((pulls[pr_number] for pr_number in pr_numbers if pr_number in pulls),
+                     key=lambda pull: pull.merged_at or "")
+    if not ordered:
+        return missing
+
+    fetch.fetch_for_pulls(pool.repo_directory, ordered)
+    applied = [pull for pull in ordered if patch_index.skip_if_applied(pool.repo_directory, store, pull)]
+    if applied:
+        tools.add_processed_prs(store, [pull.number for pull in applied])
+        ordered = [pull for pull in ordered if pull not in applied]
+        if not ordered:
+            return missing
+
+    logger.info(f"Зеркалирование пакета из {len(ordered)} PR.")
+    branch = f"{config.mirror_branch_prefix}batch-{ordered[0].number}-{ordered[-1].number}"
+    with pool.acquire() as workdir:
+        applied, failed = apply_batch(workdir, ordered, branch)
+        if applied and not push.push_refs(workdir, {branch: branch})[branch]:
+            raise RuntimeError(f"Ветка {branch} не отправлена в потомка.")
+        base_sha = mirror_base(workdir, branch) if applied else None
+    if applied:
+        open_batch_pull(downstream, applied, branch, store, base_sha)
+        tools.add_processed_prs(store, [pull.number for pull in applied])
+    return missing + [pull.number for pull in failed]
+
+
+def apply_batch(workdir, pulls, branch):
+    """
+    Переносит PR по очереди на ветку branch. PR, изменения которого конфликтуют,
+    в пакет не попадает, а ветка остаётся на предыдущем PR.
+    Возвращает списки перенесённых и исключённых PR.
+    """
+    if config.apply_engine == "objects":
+        return apply_batch_in_objects(workdir, pulls, branch)
+    return apply_batch_in_worktree(workdir, pulls, branch)
+
+
+def apply_batch_in_objects(workdir, pulls, branch):
+    applied, failed = [], []
+    with metrics.timed("cherry_pick"):
+        head = git_output(workdir, "rev-parse", "downstream/master^{commit}")
+        for pull in pulls:
+            pr_commit_shas = []
+            if len(object_apply.commit_parents(workdir, pull.merge_commit_sha)) == 1:
+                pr_commit_shas = [c.sha for c in pull.get_commits()]
+            new_head, conflicts = object_apply.mirror_commit(workdir, head, pull.merge_commit_sha,
+                                                             pull.title, pr_commit_shas, branch)
+            if conflicts:
+                failed.append(pull)
             else:
-                subprocess.run(["git", "cherry-pick", "--no-commit", "-n",
-                                original_pull.merge_commit_sha])
-                subprocess.run(["git", "add", "-A", "."])
-                subprocess.run(["git", "commit", "--no-edit",
-                               "-m", original_pull.title])
-                subprocess.run(["git", "cherry-pick", "--continue"])
+                applied.append(pull)
+                head = new_head
+        git_output(workdir, "update-ref", f"refs/heads/{branch}", head)
+    return applied, failed
+
+
+def apply_batch_in_worktree(workdir, pulls, branch):
+    applied, failed = [], []
+    with metrics.timed("clean_repo"):
+        clean_repo(workdir)
+    with metrics.timed("cherry_pick"):
+        run_git(workdir, "checkout", "-b", branch)
+        for pull in pulls:
+            head = run_git(workdir, "rev-parse", "HEAD", check=True).stdout.decode().strip()
+            if len(object_apply.commit_parents(workdir, pull.merge_commit_sha)) > 1:
+                command = ["-m", "1", pull.merge_commit_sha]
+            else:
+                # PR, влитый перемоткой, переносится по одному коммиту, как и в apply_in_worktree
+                shas = [c.sha for c in pull.get_commits()]
+                command = shas if pull.merge_commit_sha in shas else [pull.merge_commit_sha]
+            result = run_git(workdir, "cherry-pick", "--keep-redundant-commits", *command)
+            if result.returncode != 0:
+                run_git(workdir, "cherry-pick", "--abort")
+                run_git(workdir, "reset", "--hard", head)
+                failed.append(pull)
+                continue
+            if command[0] == "-m":
+                run_git(workdir, "commit", "--amend", "-m", pull.title)
+            applied.append(pull)
+    return applied, failed
+
+
+def open_batch_pull(downstream, pulls, branch, store=None, base_sha=None):
+    logger = logging.getLogger("log")
+    pr_list = "\n".join(f"- Original PR: {pull.number} {pull.title.replace('@', '')}" for pull in pulls)
+    title = f"Upstream merges #{pulls[0].number}-#{pulls[-1].number}"
+    metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls")
+    with metrics.timed("create_pull"), tracing.span("api", method="POST", endpoint="/repos/{owner}/{repo}/pulls"):
+        result = downstream.create_pull(
+            title=f"{config.mirror_pr_title_prefix}{title} [MDB IGNORE]",
+            body=f"Batch of {len(pulls)} upstream PRs:\n{pr_list}",
+            base="master",
+            head=branch,
+            maintainer_can_modify=True)
+    if pulls[0].merged_at:
+        metrics.event_lag.set(metrics.seconds_since(pulls[0].merged_at), downstream.full_name)
+    if store is not None:
+        tools.add_batch_pull(store, result.number, title, pulls, branch, base_sha)
+
+    logger.info(f"PR создан: {result.title} (#{result.number})")
+    return result
+
+
+def apply_in_worktree(workdir, original_pull, branch):
+    """
+    Переносит изменения PR на ветку branch через cherry-pick в рабочем каталоге.
+    Возвращает хеш вершины ветки и список коммитов, перенесённых с конфликтами.
+    """
+    with metrics.timed("clean_repo"):
+        clean_repo(workdir)
+    with metrics.timed("cherry_pick"):
+        conflicts = cherry_pick(workdir, original_pull, branch)
+    return run_git(workdir, "rev-parse", "HEAD", check=True).stdout.decode().strip(), conflicts
+
+
+def cherry_pick(workdir, original_pull, branch):
+    """
+    Конфликты фиксируются в коммите вместе с маркерами, как и раньше.
+    Возвращает список коммитов, перенесённых с конфликтами.
+    """
+    conflicts = []
+    run_git(workdir, "checkout", "-b", branch)
+    result = run_git(workdir, "cherry-pick", "-m", "1", original_pull.merge_commit_sha)
+    cherry_out = (result.stdout + result.stderr).decode(errors="replace")
+
+    if "mainline was specified but commit" in cherry_out:
+        commits = original_pull.get_commits()
+        if original_pull.merge_commit_sha in [c.sha for c in commits]:
+            for c in commits:
+                if run_git(workdir, "cherry-pick", "--no-commit", "-n", c.sha).returncode != 0:
+                    conflicts.append(c.sha)
+                run_git(workdir, "add", "-A", ".")
+                run_git(workdir, "commit", "--no-edit", "-m", c.message)
+                run_git(workdir, "cherry-pick", "--continue")
         else:
-            subprocess.run(["git", "add", "-A", "."])
+            if run_git(workdir, "cherry-pick", "--no-commit", "-n", original_pull.merge_commit_sha).returncode != 0:
+                conflicts.append(original_pull.merge_commit_sha)
+            run_git(workdir, "add", "-A", ".")
+            run_git(workdir, "commit", "--no-edit", "-m", original_pull.title)
+            run_git(workdir, "cherry-pick", "--continue")
+    else:
+        if result.returncode != 0:
+            conflicts.append(original_pull.merge_commit_sha)
+        run_git(workdir, "add", "-A", ".")
+
+    run_git(workdir, "commit", "--allow-empty", "--no-edit", "-m", original_pull.title)
+    return conflicts
 
-        subprocess.run(["git", "commit", "--allow-empty", "--no-edit", "-m", original_pull.title],
-                       )
-        subprocess.run(["git", "push", "downstream",
-                        f"{config.mirror_branch_prefix}{pr_id}"], )
 
-        pr_body = original_pull.body if original_pull.body != None else ""
+def apply_in_objects(workdir, original_pull, branch):
+    """
+    Переносит изменения PR на ветку branch, не трогая рабочий каталог:
+    коммиты строятся через git merge-tree и commit-tree.
+    """
+    with metrics.timed("cherry_pick"):
+        pr_commit_shas = []
+        if len(object_apply.commit_parents(workdir, original_pull.merge_commit_sha)) == 1:
+            pr_commit_shas = [c.sha for c in original_pull.get_commits()]
+        return object_apply.mirror_commit(workdir, "downstream/master", original_pull.merge_commit_sha,
+                                          original_pull.title, pr_commit_shas, branch)
+
+
+def apply_pull(workdir, original_pull, branch):
+    """
+    Переносит PR выбранным движком. Возвращает хеш вершины ветки и список
+    коммитов, перенесённых с конфликтами.
+    """
+    if config.apply_engine == "objects":
+        return apply_in_objects(workdir, original_pull, branch)
+    return apply_in_worktree(workdir, original_pull, branch)
+
+
+def conflict_note(conflicts):
+    """
+    Предупреждение для описания PR потомка о коммитах, перенесённых с конфликтами.
+    """
+    if not conflicts:
+        return ""
+    return ("\n-----\nWARNING: changes of " + ", ".join(conflicts) +
+            " conflicted with master and were committed with conflict markers.")
+
+
+def open_mirror_pull(downstream, original_pull, branch, store=None, base_sha=None, conflicts=None):
+    logger = logging.getLogger("log")
+    pr_body = original_pull.body if original_pull.body != None else ""
+    metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls")
+    with metrics.timed("create_pull"), tracing.span("api", method="POST", endpoint="/repos/{owner}/{repo}/pulls"):
         result = downstream.create_pull(title=f"{config.mirror_pr_title_prefix}{original_pull.title} [MDB IGNORE]",
-                                        body=f"Original PR: {pr_id}\n-----\n{pr_body.replace('@', '')}",
+                                        body=f"Original PR: {original_pull.number}\n-----\n{pr_body.replace('@', '')}"
+                                             f"{conflict_note(conflicts)}",
                                         base="master",
-                                        head=f"{config.mirror_branch_prefix}{pr_id}",
+                                        head=branch,
                                         maintainer_can_modify=True)
+    if original_pull.merged_at:
+        # Время слияния совпадает со временем события о нём в ленте
+        metrics.event_lag.set(metrics.seconds_since(original_pull.merged_at), downstream.full_name)
+    if store:
+        tools.add_mirror_pull(store, result.number, original_pull, branch, base_sha)
+
+    logger.info(f"PR создан: {result.title} (#{result.number})")
+    return result
+
 
-        logger.info(f"PR создан: {result.title} (#{result.number})")
-        os.chdir(current_directory)
-        tools.add_processed_pr(pr_id)
-        return result
+def load_pull(upstream, pr_id, workdir, original_pull=None, refresh_base=True):
+    """
+    Получает данные PR, если они ещё не известны, и загружает его коммиты.
+    """
+    if original_pull is None:
+        metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls/{number}")
+        with tracing.span("api", method="GET", endpoint="/repos/{owner}/{repo}/pulls/{number}"):
+            original_pull = api.PullInfo.from_pull(upstream.get_pull(pr_id))
+    fetch.fetch_for_pulls(workdir, [original_pull], refresh_base)
+    return original_pull
+
+
+def build_mirror_branch(workdir, original_pull):
+    """
+    Переносит изменения PR на локальную ветку зеркала.
+    Возвращает имя ветки, хеш её вершины, коммит master потомка, на котором она построена,
+    и список коммитов, перенесённых с конфликтами.
+    """
+    branch = f"{config.mirror_branch_prefix}{original_pull.number}"
+    head, conflicts = apply_pull(workdir, original_pull, branch)
+    if conflicts:
+        logging.getLogger("log").warning(
+            f"PR #{original_pull.number} перенесён с конфликтами, они будут отмечены в описании PR потомка.")
+    return branch, head, mirror_base(workdir, branch), conflicts
+
+
+def mirror_base(workdir, branch):
+    return git_output(workdir, "merge-base", branch, "downstream/master")
+
+
+def mirror_pr(upstream, downstream, pr_id, workdir, original_pull=None, refresh_base=True, store=None):
+    """
+    Возвращает созданный PR, AppliedChange, если изменения уже есть в потомке,
+    или None при ошибке.
+    """
+    logger = logging.getLogger("log")
+    logger.info(f"Зеркалирование PR #{pr_id}.")
+    try:
+        state = progress.get(store, pr_id)
+        if progress.reached(state, progress.OPENED):
+            logger.info(f"PR потомка для #{pr_id} уже создан (#{state['mirror_number']}).")
+            return progress.OpenedPull(pr_id, state["mirror_number"])
+        original_pull = load_pull(upstream, pr_id, workdir, original_pull, refresh_base)
+        built = progress.built_branch(workdir, state)
+        if built:
+            logger.info(f"Продолжение зеркалирования PR #{pr_id} с этапа {state['stage']}.")
+            branch, head, base_sha = built
+        else:
+            applied = patch_index.skip_if_applied(workdir, store, original_pull)
+            if applied:
+                return applied
+            record_fetched(store, original_pull)
+            branch, head, base_sha, conflicts = build_mirror_branch(workdir, original_pull)
+            progress.record(store, pr_id, progress.APPLIED, branch=branch, head=head, base_sha=base_sha,
+                            conflicts=" ".join(conflicts))
+        if not progress.reached(state, progress.PUSHED):
+            if not push.push_refs(workdir, {branch: head})[branch]:
+                raise RuntimeError(f"Ветка {branch} не отправлена в потомка.")
+            progress.record(store, pr_id, progress.PUSHED)
+        return open_or_find_pull(downstream, original_pull, branch, store, base_sha, state)
     except:
         logger.exception(
             f"Во время зеркалирования PR #{pr_id} произошла ошибка.")
-    finally:
-        os.chdir(current_directory)
 
 
-def remirror_pr(upstream, downstream, mirror_pr_id):
+def remirror_pr(upstream, downstream, mirror_pr_id, workdir, store=None):
     logger = logging.getLogger("log")
     logger.info(f"Remirroring #{mirror_pr_id}.")
-    current_directory = os.getcwd()
     try:
-        os.chdir(config.local_repo_directory)
-        mirror_pull = downstream.get_pull(mirror_pr_id)
-        # Get original PR number from the "Original PR: " link
-        original_pull = upstream.get_pull(
-            int(mirror_pull.body.split("/")[6].split("\n")[0]))
-        clean_repo()
-        logger.debug("Switching to mirror branch.")
-        subprocess.run(["git", "checkout", "-b", f"{config.mirror_branch_prefix}{original_pull.number}"],
-                       )
-        logger.debug("Cherry-picking merge commit.")
-        subprocess.run(["git", "cherry-pick", "-m", "1", original_pull.merge_commit_sha],
-                       )
+        mapping = tools.get_mirror_pull(store, mirror_pr_id) if store else None
+        batch = []
+        if mapping is None:
+            original_pull = find_original_pull(upstream, downstream, mirror_pr_id)
+            base_sha = None
+            branch = f"{config.mirror_branch_prefix}{original_pull.number}"
+        else:
+            original_pull = mapped_pull(upstream, mapping)
+            batch = [mapped_pull(upstream, item) for item in mapping["batch"]]
+            base_sha = mapping["base_sha"]
+            branch = mapping["branch"]
+        fetch.fetch_for_pulls(workdir, batch or [original_pull])
+        current_base = git_output(workdir, "rev-parse", "downstream/master")
+        if base_sha == current_base:
+            # Ветка уже построена из того же коммита слияния поверх того же master
+            logger.info(f"Ветка {branch} уже актуальна, повторная отправка не требуется.")
+            return True
+        if batch:
+            # PR пакетного режима: ветка пакета пересобирается из всех его PR
+            _, failed = apply_batch(workdir, batch, branch)
+            if failed:
+                logger.error(f"PR {', '.join(f'#{pull.number}' for pull in failed)} из пакета #{mirror_pr_id} "
+                             f"конфликтуют с master потомка, пакет не пересобран.")
+                return False
+        else:
+            _, conflicts = apply_pull(workdir, original_pull, branch)
+            if conflicts:
+                # Ветка с маркерами конфликтов не заменяет рабочее зеркало, база не запоминается,
+                # чтобы remirror можно было повторить после исправления master потомка
+                logger.error(f"PR #{original_pull.number} конфликтует с master потомка, "
+                             f"ветка {branch} не обновлена.")
+                return False
         logger.debug("Force pushing to downstream.")
-        subprocess.run(["git", "push", "--force", "downstream",
-                        f"{config.mirror_branch_prefix}{original_pull.number}"], )
+        if not push.push_refs(workdir, {branch: branch}, force=True)[branch]:
+            return False
+        if store:
+            if mapping is None:
+                tools.add_mirror_pull(store, mirror_pr_id, original_pull, branch, current_base)
+            else:
+                tools.update_mirror_base(store, mirror_pr_id, current_base)
+        return True
     except:
         logger.exception("An error occured during remirroring.")
-    finally:
-        os.chdir(current_directory)
+        return False
+
+
+def mapped_pull(upstream, mapping):
+    """
+    Собирает PullInfo из таблицы соответствия. Пустой список коммитов означает, что
+    при записи он был неизвестен: тогда коммиты загружаются из GitHub, если понадобятся
+    для PR, влитого перемоткой.
+    """
+    number = mapping["original_number"]
+
+    def load_commits():
+        metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls/{number}")
+        return api.PullInfo.from_pull(upstream.get_pull(number)).get_commits()
+
+    commits = [api.PullCommit(sha, None) for sha in mapping["commit_shas"]] or None
+    return api.PullInfo(number, mapping["title"], None, mapping["merge_commit_sha"], commits=commits,
+                        commits_loader=load_commits)
+
 
+def find_original_pull(upstream, downstream, mirror_pr_id):
+    """
+    Находит PR предка по описанию PR зеркала. Нужно только для PR, созданных до
+    появления таблицы соответствия в рабочем логе.
+    """
+    metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls/{number}", amount=2)
+    mirror_pull = downstream.get_pull(mirror_pr_id)
+    # "Original PR: 123" или ссылка "Original PR: https://github.com/owner/repo/pull/123"
+    matches = re.findall(r"Original PR: (?:\S*/pull/)?(\d+)", mirror_pull.body or "")
+    if not matches:
+        raise ValueError(f"В описании PR #{mirror_pr_id} нет ссылки на PR предка.")
+    if len(matches) > 1:
+        # PR пакета без записи в рабочем логе: пересобрать можно только его ветку целиком
+        raise ValueError(f"PR #{mirror_pr_id} - пакет из нескольких PR без записи в рабочем логе.")
+    return api.PullInfo.from_pull(upstream.get_pull(int(matches[0])))
 
-def github_event_stream(github_api, repos, req_types):
+
+def github_event_stream(client, repos, req_types, schedulers=(), run_pending=True, cursor=None, refresh=None):
     logger = logging.getLogger("log")
-    last_seen_ids = {}
-    for repo in repos:
-        last_seen_ids[repo.html_url] = int(repo.get_events()[0].id)
+    cursor = cursor or event_cursor.EventCursor()
+    cursor.start(client, repos)
+    last_seen_ids = cursor.last_seen_ids
+    etags = cursor.etags
+    page_counts = cursor.page_counts
     logger.info("Запуск потока событий.")
+    # Сначала события, пропущенные за время простоя и дочитанные при запуске
+    for repo in repos:
+        pending = cursor.take_pending(repo)
+        yield from deliver_events(cursor, repo, pending, req_types)
+        if pending:
+            cursor.save(repo)
     for i in range(60):
-        requests_left, request_limit = github_api.rate_limiting
+        if refresh:
+            refresh()
+        if schedulers:
+            # Квота общая для всех пар, поэтому достаточно проверить её у одного планировщика
+            schedulers[0].wait_for_budget("poll", len(repos))
+        requests_left = client.requests_left
+        saved_requests = 0
+        poll_interval = 0
         for repo in repos:
-            event_list = []
             try:
-                for e in repo.get_events():
-                    event_list.append(e)
+                event_list, poll = client.poll_events(
+                    repo.full_name, last_seen_ids[repo.html_url], etags.get(repo.html_url))
             except:
                 logger.exception("Произошла ошибка при получении событий.")
                 continue
-            event_list = [e for e in event_list if int(
-                e.id) > last_seen_ids[repo.html_url]]
-            event_list.sort(key=lambda e: int(e.id))
+            etags[repo.html_url] = poll.etag
+            poll_interval = max(poll_interval, poll.poll_interval)
+            # Сколько страниц ленты запросил бы полный обход без условных запросов
+            if poll.not_modified:
+                saved_requests += page_counts[repo.html_url]
+            else:
+                page_counts[repo.html_url] = poll.total_pages
+                saved_requests += poll.total_pages - poll.pages
             if not event_list:
                 logger.debug("Нет новых событий.")  # "No new events."
-            for e in event_list:
-                if e.type in req_types:
-                    logger.debug("Передача события.")  # "Yielding event."
-                    yield repo, e
-                last_seen_ids[repo.html_url] = int(e.id)
-        requests_left_after, request_limit_after = github_api.rate_limiting
-        logger.info(f"Иттерация: {i} Выполнено {requests_left - requests_left_after} запросов ({requests_left_after} осталось)")
-        logger.debug(f"Проверка через {config.event_stream_wait} секунд.")
-        time.sleep(config.event_stream_wait)
+            yield from deliver_events(cursor, repo, event_list, req_types)
+            if not poll.not_modified:
+                cursor.save(repo)
+        requests_left_after = client.requests_left
+        if requests_left is not None and requests_left_after is not None:
+            logger.info(f"Иттерация: {i} Выполнено {requests_left - requests_left_after} запросов ({requests_left_after} осталось), сэкономлено {saved_requests}")
+        else:
+            logger.info(f"Иттерация: {i} Сэкономлено {saved_requests} запросов")
+        if run_pending:
+            # Повторы и отложенные задачи выполняются и в отсутствие новых событий
+            for scheduler in schedulers:
+                scheduler.run_pending()
+        wait = max(config.event_stream_wait, poll_interval)
+        logger.debug(f"Проверка через {wait} секунд.")
+        time.sleep(wait)
+
+
+def deliver_events(cursor, repo, events, req_types):
+    """
+    Передаёт события потребителю и сдвигает положение ленты. События из окна
+    уже обработанных, например повторно дочитанные после сбоя, пропускаются.
+    """
+    logger = logging.getLogger("log")
+    for e in events:
+        if e.type in req_types and not cursor.is_seen(repo, e):
+            logger.debug("Передача события.")  # "Yielding event."
+            yield repo, e
+            cursor.handled(repo, e)
+        cursor.last_seen_ids[repo.html_url] = int(e.id)
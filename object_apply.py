@@ -0,0 +1,71 @@
+import os
+import logging
+import subprocess
+from gitcmd import run_git, git_output
+
+
+def commit_parents(workdir, commit):
+    return git_output(workdir, "rev-list", "--parents", "-n", "1", commit).split()[1:]
+
+
+def author_env(workdir, commit):
+    name, email, date = git_output(workdir, "log", "-1", "--format=%an%x00%ae%x00%ad", "--date=raw", commit).split("\0")
+    env = dict(os.environ)
+    env.update({"GIT_AUTHOR_NAME": name, "GIT_AUTHOR_EMAIL": email, "GIT_AUTHOR_DATE": date})
+    return env
+
+
+def pick_tree(workdir, onto, commit, parent):
+    """
+    Вычисляет дерево cherry-pick коммита commit (относительно parent) поверх onto
+    без рабочего каталога. Возвращает хеш дерева и признак конфликта.
+    """
+    # merge-tree до git 2.40 не принимает --merge-base, поэтому база слияния задаётся
+    # синтетическим коммитом с деревом onto и единственным родителем parent.
+    onto_tree = git_output(workdir, "rev-parse", f"{onto}^{{tree}}")
+    synthetic = git_output(workdir, "commit-tree", onto_tree, "-p", parent, "-m", "cherry-pick base")
+    result = run_git(workdir, "merge-tree", "--write-tree", "--no-messages", synthetic, commit)
+    if result.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+    tree = result.stdout.decode().splitlines()[0].strip()
+    return tree, result.returncode == 1
+
+
+def pick_commit(workdir, onto, commit, message=None, mainline=1):
+    """
+    Создаёт коммит с изменениями commit поверх onto. Для коммитов слияния изменения
+    берутся относительно родителя mainline. Возвращает хеш нового коммита и признак конфликта.
+    """
+    parents = commit_parents(workdir, commit)
+    parent = parents[mainline - 1] if len(parents) > 1 else parents[0]
+    tree, conflicted = pick_tree(workdir, onto, commit, parent)
+    if message is None:
+        message = git_output(workdir, "log", "-1", "--format=%B", commit)
+    new_commit = git_output(workdir, "commit-tree", tree, "-p", onto, "-m", message,
+                            env=author_env(workdir, commit))
+    return new_commit, conflicted
+
+
+def mirror_commit(workdir, base, merge_commit_sha, title, pr_commit_shas, branch):
+    """
+    Строит коммиты зеркала PR в хранилище объектов и переводит на них ветку branch.
+    Повторяет поведение worktree-движка: коммит слияния переносится относительно
+    первого родителя, а PR, влитый перемоткой, переносится по одному коммиту.
+    Возвращает хеш вершины ветки и список коммитов, перенесённых с конфликтами.
+    """
+    logger = logging.getLogger("log")
+    head = git_output(workdir, "rev-parse", f"{base}^{{commit}}")
+    conflicts = []
+    if len(commit_parents(workdir, merge_commit_sha)) == 1 and merge_commit_sha in pr_commit_shas:
+        for sha in pr_commit_shas:
+            head, conflicted = pick_commit(workdir, head, sha)
+            if conflicted:
+                conflicts.append(sha)
+    else:
+        head, conflicted = pick_commit(workdir, head, merge_commit_sha, message=title)
+        if conflicted:
+            conflicts.append(merge_commit_sha)
+    if conflicts:
+        logger.warning(f"Изменения {', '.join(conflicts)} перенесены с конфликтами.")
+    git_output(workdir, "update-ref", f"refs/heads/{branch}", head)
+    return head, conflicts
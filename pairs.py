@@ -0,0 +1,52 @@
+import config
+
+
+class MirrorPair:
+    """
+    Пара репозиториев предок -> потомок со своим локальным клоном и рабочим логом.
+    """
+
+    def __init__(self, upstream_owner, upstream_repo, downstream_owner, downstream_repo,
+                 local_repo_directory, state_db_file, work_log_file=None, mirror_workers=None):
+        self.upstream_owner = upstream_owner
+        self.upstream_repo = upstream_repo
+        self.downstream_owner = downstream_owner
+        self.downstream_repo = downstream_repo
+        self.local_repo_directory = local_repo_directory
+        self.state_db_file = state_db_file
+        self.work_log_file = work_log_file
+        self.mirror_workers = mirror_workers or config.mirror_workers
+
+    @property
+    def upstream_name(self):
+        return f"{self.upstream_owner}/{self.upstream_repo}"
+
+    @property
+    def downstream_name(self):
+        return f"{self.downstream_owner}/{self.downstream_repo}"
+
+    def __str__(self):
+        return f"{self.upstream_name} -> {self.downstream_name}"
+
+
+def load_pairs():
+    """
+    Читает пары репозиториев из config.mirror_pairs. Если список пуст, возвращает
+    единственную пару из параметров upstream_*/downstream_* конфигурации.
+    """
+    if not config.mirror_pairs:
+        return [MirrorPair(config.upstream_owner, config.upstream_repo,
+                           config.downstream_owner, config.downstream_repo,
+                           config.local_repo_directory, config.state_db_file, config.work_log_file)]
+
+    pairs = []
+    for settings in config.mirror_pairs:
+        suffix = f"{settings['downstream_owner']}-{settings['downstream_repo']}"
+        pairs.append(MirrorPair(
+            settings["upstream_owner"], settings["upstream_repo"],
+            settings["downstream_owner"], settings["downstream_repo"],
+            settings.get("local_repo_directory", f"{config.local_repo_directory}-{suffix}"),
+            settings.get("state_db_file", f"work_log-{suffix}.sqlite3"),
+            settings.get("work_log_file"),
+            settings.get("mirror_workers")))
+    return pairs
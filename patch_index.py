@@ -0,0 +1,123 @@
+import logging
+import threading
+import subprocess
+import config
+import fetch
+import metrics
+from gitcmd import run_git, git_output, pipe_git
+
+# Обновление индекса выполняется одним рабочим за раз
+index_lock = threading.Lock()
+
+INDEX_HEAD_KEY = "patch_index_head"
+
+
+class AppliedChange:
+    """
+    Результат зеркалирования PR, изменения которого уже есть в потомке.
+    """
+
+    def __init__(self, number, commit):
+        self.number = number
+        self.commit = commit
+
+
+def patch_ids(workdir, source_args):
+    """
+    Возвращает пары (patch-id, коммит) для вывода git log -p или git diff. Вывод
+    передаётся в git patch-id по каналу и не собирается в памяти целиком.
+    """
+    output = pipe_git(workdir, source_args, "patch-id", "--stable").stdout.decode()
+    return [tuple(line.split()) for line in output.splitlines() if line.strip()]
+
+
+def log_patch_ids(workdir, revisions):
+    """
+    Возвращает пары (patch-id, коммит) для коммитов revisions.
+    """
+    return patch_ids(workdir, ["log", "-p", "--no-merges", "--no-color", "--format=commit %H", *revisions])
+
+
+def diff_patch_id(workdir, base, commit):
+    ids = patch_ids(workdir, ["diff", "--no-color", base, commit])
+    return ids[0][0] if ids else None
+
+
+def update_index(workdir, store, ref="downstream/master"):
+    """
+    Добавляет в индекс patch-id коммитов потомка, появившихся после прошлого обновления.
+    При первом запуске индексируются последние patch_index_max_commits коммитов,
+    в частичном клоне - не больше patch_index_partial_max_commits за раз.
+    """
+    logger = logging.getLogger("log")
+    with index_lock:
+        head = git_output(workdir, "rev-parse", ref)
+        indexed = store.get_meta(INDEX_HEAD_KEY)
+        if indexed == head:
+            return
+        limit = []
+        if fetch.is_partial(workdir):
+            if not config.patch_index_partial_max_commits:
+                return
+            # Содержимое старых файлов не загружается ради индекса
+            limit = [f"--max-count={config.patch_index_partial_max_commits}"]
+        if indexed and run_git(workdir, "merge-base", "--is-ancestor", indexed, head).returncode == 0:
+            revisions = [*limit, f"{indexed}..{head}"]
+        else:
+            # История потомка переписана или индекс ещё не построен
+            revisions = limit or [f"--max-count={config.patch_index_max_commits}"]
+            revisions.append(head)
+        rows = log_patch_ids(workdir, revisions)
+        with store.transaction():
+            store.add_patch_ids(rows)
+            store.set_meta(INDEX_HEAD_KEY, head)
+        logger.debug(f"В индекс patch-id добавлено {len(rows)} коммитов потомка.")
+
+
+def find_applied(workdir, store, pull):
+    """
+    Возвращает коммит потомка, в котором уже есть изменения PR, или None.
+    PR считается перенесённым, если в потомке есть коммит с тем же patch-id, что и
+    у всего PR, или, для PR, влитого перемоткой, коммиты со всеми его patch-id.
+    """
+    update_index(workdir, store)
+    parents = git_output(workdir, "rev-list", "--parents", "-n", "1", pull.merge_commit_sha).split()[1:]
+    if not parents:
+        return None
+    patch_id = diff_patch_id(workdir, parents[0], pull.merge_commit_sha)
+    commit = store.find_patch_id(patch_id) if patch_id else None
+    if commit:
+        return commit
+
+    shas = [c.sha for c in pull.get_commits()] if len(parents) == 1 else []
+    if pull.merge_commit_sha not in shas:
+        return None
+    commits = []
+    for sha in shas:
+        patch_id = diff_patch_id(workdir, f"{sha}^", sha)
+        commit = store.find_patch_id(patch_id) if patch_id else None
+        if commit is None:
+            return None
+        commits.append(commit)
+    return commits[-1] if commits else None
+
+
+def skip_if_applied(workdir, store, pull):
+    """
+    Проверяет PR по индексу перед переносом. Возвращает AppliedChange, если
+    изменения уже есть в потомке, иначе None.
+    """
+    logger = logging.getLogger("log")
+    if not config.skip_applied_changes or store is None:
+        return None
+    try:
+        with metrics.timed("patch_index"):
+            commit = find_applied(workdir, store, pull)
+    except subprocess.CalledProcessError:
+        # Например, в неглубоком клоне нет родителя коммита: PR переносится как обычно
+        logger.warning(f"Не удалось проверить, перенесён ли уже PR #{pull.number}.")
+        return None
+    if commit is None:
+        return None
+    logger.info(f"Изменения PR #{pull.number} уже есть в потомке ({commit[:10]}). Пропуск.")
+    return AppliedChange(pull.number, commit)
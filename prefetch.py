@@ -0,0 +1,128 @@
+import shutil
+import logging
+import threading
+import config
+import fetch
+import metrics
+from gitcmd import run_git
+
+# Загруженные заранее вершины PR и основная ветка предка. Ссылки вне refs/heads
+# не трогает очистка рабочих каталогов, и объекты не собираются сборщиком мусора
+PREFETCH_REFS = "refs/prefetch"
+# Сколько ссылок загружается одним git fetch: между запусками блокировка загрузки
+# освобождается, и зеркалирование не ждёт весь проход
+PREFETCH_CHUNK_SIZE = 20
+
+
+def low_priority():
+    """
+    Префикс команды с наименьшим приоритетом процессора и, где есть ionice, диска.
+    preexec_fn не используется: он небезопасен при запуске из нескольких потоков.
+    """
+    prefix = ["nice", "-n", "19"] if shutil.which("nice") else []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c3"]
+    return prefix
+
+
+class Prefetcher:
+    """
+    Фоновая загрузка основной ветки предка и вершин его открытых PR в локальный клон.
+    Коммит слияния PR достижим из основной ветки, а коммиты PR - из его вершины, поэтому
+    к моменту слияния fetch_for_pulls находит все объекты локально и не ходит в сеть.
+    """
+
+    def __init__(self, workdir, client, owner, name, has_budget):
+        self.logger = logging.getLogger("log")
+        self.workdir = workdir
+        self.client = client
+        self.owner = owner
+        self.name = name
+        self.has_budget = has_budget
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=f"prefetch-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if config.prefetch_enabled:
+                try:
+                    self.prefetch()
+                except Exception:
+                    self.logger.exception("Ошибка фоновой загрузки изменений предка.")
+            self.stopped.wait(config.prefetch_interval)
+
+    def prefetch(self):
+        if not self.has_budget("prefetch"):
+            self.logger.debug("Фоновая загрузка пропущена: квота GitHub API нужна для зеркалирования.")
+            return
+        heads = self.client.get_open_pull_heads(self.owner, self.name, config.prefetch_max_pulls)
+        # Загружаются только вершины, которых ещё нет локально
+        refspecs = [f"+HEAD:{PREFETCH_REFS}/upstream-head"] + [
+            f"+refs/pull/{number}/head:{PREFETCH_REFS}/pull/{number}"
+            for number, sha in heads.items() if not fetch.has_commit(self.workdir, sha)]
+        depth = [f"--depth={config.shallow_fetch_depth}"] if fetch.is_shallow(self.workdir) else []
+        with metrics.timed("prefetch"):
+            for start in range(0, len(refspecs), PREFETCH_CHUNK_SIZE):
+                # Пока зеркалирование загружает изменения, проход пропускается, а не ждёт его
+                if not fetch.fetch_lock.acquire(blocking=False):
+                    self.logger.debug("Фоновая загрузка прервана: зеркалирование загружает изменения.")
+                    return
+                try:
+                    run_git(self.workdir, "fetch", "--no-tags", *depth, "upstream",
+                            *refspecs[start:start + PREFETCH_CHUNK_SIZE], prefix=low_priority())
+                finally:
+                    fetch.fetch_lock.release()
+        self.logger.debug(f"Фоновая загрузка: загружено {len(refspecs) - 1} вершин PR, открыто {len(heads)}.")
+        self.prune(list(heads))
+
+    def pull_refs(self):
+        output = run_git(self.workdir, "for-each-ref", "--format=%(refname)", f"{PREFETCH_REFS}/pull/",
+                         prefix=low_priority()).stdout.decode()
+        return output.splitlines()
+
+    def delete_refs(self, refs):
+        if refs:
+            run_git(self.workdir, "update-ref", "--stdin", input="".join(f"delete {ref}\n" for ref in refs).encode(),
+                    check=True, prefix=low_priority())
+
+    def disk_usage_mb(self):
+        output = run_git(self.workdir, "count-objects", "-v", prefix=low_priority()).stdout.decode()
+        sizes = dict(line.split(": ", 1) for line in output.splitlines() if ": " in line)
+        return (int(sizes.get("size", 0)) + int(sizes.get("size-pack", 0))) / 1024
+
+    def prune(self, numbers):
+        """
+        Удаляет вершины закрытых PR и PR, вышедших за prefetch_max_pulls. Если хранилище
+        объектов больше prefetch_disk_budget_mb, удаляет вершины начиная с давно
+        обновлённых PR и вычищает объекты, на которые больше нет ссылок.
+        numbers - открытые PR от недавно обновлённых к давно обновлённым.
+        """
+        kept = [f"{PREFETCH_REFS}/pull/{number}" for number in numbers]
+        refs = self.pull_refs()
+        self.delete_refs([ref for ref in refs if ref not in kept])
+        if not config.prefetch_disk_budget_mb:
+            return
+        kept = [ref for ref in kept if ref in refs]
+        usage = self.disk_usage_mb()
+        while usage > config.prefetch_disk_budget_mb:
+            if not kept:
+                self.logger.warning("Хранилище объектов клона больше prefetch_disk_budget_mb "
+                                    "даже без загруженных заранее PR.")
+                return
+            # Объекты моложе часа не удаляются: их может использовать идущий сейчас перенос,
+            # поэтому сборка мусора не блокирует загрузки зеркалирования
+            kept, dropped = kept[:len(kept) // 2], kept[len(kept) // 2:]
+            self.delete_refs(dropped)
+            run_git(self.workdir, "gc", "--quiet", "--prune=1.hour.ago", prefix=low_priority())
+            self.logger.info(f"Фоновая загрузка: удалено {len(dropped)} вершин PR для соблюдения предела размера.")
+            previous, usage = usage, self.disk_usage_mb()
+            if usage >= previous:
+                # Удалённые объекты ещё слишком свежие, следующий проход попробует снова
+                return
@@ -0,0 +1,126 @@
+import logging
+import api
+import fetch
+import metrics
+import tools
+import tracing
+from gitcmd import run_git
+
+# Этапы зеркалирования PR в порядке выполнения
+FETCHED = "fetched"
+APPLIED = "applied"
+PUSHED = "pushed"
+OPENED = "opened"
+STAGES = [FETCHED, APPLIED, PUSHED, OPENED]
+
+
+class OpenedPull:
+    """
+    Результат зеркалирования PR, для которого PR потомка был создан при прошлой попытке.
+    """
+
+    def __init__(self, number, mirror_number):
+        self.number = number
+        self.mirror_number = mirror_number
+
+
+def record(store, number, stage, **artifacts):
+    """
+    Сохраняет этап PR и его артефакты: fetched - коммит слияния и заголовок,
+    applied - ветка, её вершина, коммит master потомка и коммиты, перенесённые
+    с конфликтами (через пробел), opened - номер PR потомка.
+    """
+    if store is not None:
+        store.set_pr_progress(number, stage, artifacts)
+
+
+def get(store, number):
+    return store.get_pr_progress(number) if store is not None else None
+
+
+def reached(state, stage):
+    return state is not None and STAGES.index(state["stage"]) >= STAGES.index(stage)
+
+
+def built_branch(workdir, state):
+    """
+    Возвращает (ветка, вершина, master потомка), если ветка уже построена
+    при прошлой попытке и её коммит есть в локальном хранилище, иначе None.
+    """
+    if reached(state, APPLIED) and state["head"] and fetch.has_commit(workdir, state["head"]):
+        return state["branch"], state["head"], state["base_sha"]
+    return None
+
+
+def conflicts(store, number):
+    """
+    Возвращает коммиты PR, перенесённые с конфликтами при построении ветки.
+    """
+    state = get(store, number)
+    return state["conflicts"].split() if state and state["conflicts"] else []
+
+
+def find_open_pull(downstream, branch):
+    """
+    Ищет открытый PR потомка из ветки branch, например созданный попыткой,
+    ответ на которую не дошёл.
+    """
+    owner = downstream.full_name.split("/")[0]
+    metrics.api_calls.inc("rest", "/repos/{owner}/{repo}/pulls")
+    with tracing.span("api", method="GET", endpoint="/repos/{owner}/{repo}/pulls"):
+        for pull in downstream.get_pulls(state="open", head=f"{owner}:{branch}"):
+            return pull
+    return None
+
+
+def remote_branches(workdir):
+    output = run_git(workdir, "ls-remote", "--heads", "downstream", check=True).stdout.decode()
+    branches = {}
+    for line in output.splitlines():
+        sha, ref = line.split("\t")
+        branches[ref[len("refs/heads/"):]] = sha
+    return branches
+
+
+def recover(store, downstream, workdir):
+    """
+    Сверяет записанные этапы незавершённых PR с ветками и PR потомка:
+    ветка, которой нет в потомке, снова отправляется, отсутствующий локально
+    коммит строится заново, а найденный PR потомка завершает зеркалирование.
+    """
+    logger = logging.getLogger("log")
+    unfinished = store.get_unfinished_prs()
+    if not unfinished:
+        return
+    logger.info(f"Проверка состояния {len(unfinished)} незавершённых PR.")
+    remote = remote_branches(workdir)
+    for state in unfinished:
+        number = state["number"]
+        stage = state["stage"]
+        if stage == OPENED:
+            tools.add_processed_pr(store, number)
+            continue
+        if stage in (APPLIED, PUSHED) and state["branch"]:
+            pushed = remote.get(state["branch"]) == state["head"]
+            if pushed and stage == APPLIED:
+                stage = PUSHED
+            elif not pushed and stage == PUSHED:
+                stage = APPLIED
+        if stage == APPLIED and not (state["head"] and fetch.has_commit(workdir, state["head"])):
+            stage = FETCHED
+        if stage == PUSHED:
+            try:
+                mirror_pull = find_open_pull(downstream, state["branch"])
+            except Exception:
+                logger.exception(f"Не удалось проверить PR потомка для #{number}.")
+                mirror_pull = None
+            if mirror_pull is not None:
+                logger.info(f"PR #{number} уже зеркалирован в #{mirror_pull.number}.")
+                record(store, number, OPENED, mirror_number=mirror_pull.number)
+                original_pull = api.PullInfo(number, state["title"], None, state["merge_commit_sha"])
+                tools.add_mirror_pull(store, mirror_pull.number, original_pull, state["branch"], state["base_sha"])
+                tools.add_processed_pr(store, number)
+                continue
+        if stage != state["stage"]:
+            logger.info(f"Этап PR #{number} исправлен: {state['stage']} -> {stage}.")
+            record(store, number, stage)
@@ -0,0 +1,61 @@
+import logging
+import config
+import metrics
+from gitcmd import run_git
+
+# Флаги git push --porcelain, означающие, что ссылка в удалённом репозитории
+# указывает на отправленный коммит: перемотка, принудительное обновление,
+# новая ссылка, удаление и "уже актуальна"
+LANDED_FLAGS = " +*-="
+
+
+def push_arguments(refs, force=False, atomic=False, remote="downstream"):
+    refspecs = [f"{'+' if force else ''}{source}:refs/heads/{branch}" for branch, source in refs.items()]
+    return ["push", "--porcelain", *(["--atomic"] if atomic else []), remote, *refspecs]
+
+
+def parse_porcelain(output, branches):
+    """
+    Разбирает вывод git push --porcelain. Возвращает словарь ветка -> True,
+    если ссылка обновлена. Ветки, которых нет в выводе, считаются неотправленными.
+    """
+    results = {branch: False for branch in branches}
+    for line in output.splitlines():
+        parts = line.split("\t")
+        if len(parts) < 3 or ":" not in parts[1]:
+            continue
+        flag = parts[0][:1]
+        ref = parts[1].split(":", 1)[1]
+        branch = ref[len("refs/heads/"):] if ref.startswith("refs/heads/") else ref
+        if branch in results:
+            results[branch] = flag in LANDED_FLAGS
+    return results
+
+
+def push_refs(workdir, refs, force=False, atomic=None):
+    """
+    Отправляет все ветки одним запуском git push: одно соединение и одно
+    согласование ссылок вместо отдельного push на каждую ветку.
+    refs - словарь ветка потомка -> локальная ветка или хеш коммита. Хранилище объектов
+    общее для всех рабочих каталогов клона, поэтому отправлять можно из любого, даже
+    если локальная ветка уже удалена при очистке другого каталога.
+    atomic - отправить все ветки или ни одной, по умолчанию config.push_atomic.
+    Возвращает словарь ветка -> True, если ветка попала в потомка.
+    """
+    if not refs:
+        return {}
+    if atomic is None:
+        atomic = config.push_atomic
+    with metrics.timed("push"):
+        result = run_git(workdir, *push_arguments(refs, force, atomic))
+    results = parse_porcelain(result.stdout.decode(errors="replace"), list(refs))
+    log_results(results, result.stderr.decode(errors="replace"))
+    return results
+
+
+def log_results(results, stderr):
+    logger = logging.getLogger("log")
+    rejected = [branch for branch, landed in results.items() if not landed]
+    logger.debug(f"Отправлено веток: {len(results) - len(rejected)} из {len(results)}.")
+    if rejected:
+        logger.error(f"Не удалось отправить ветки {', '.join(rejected)}: {stderr.strip()}")
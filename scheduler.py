@@ -0,0 +1,128 @@
+import time
+import threading
+import logging
+from datetime import datetime, timezone
+import config
+
+# Приоритеты задач: свежие слияния обрабатываются раньше старого бэклога
+PRIORITY_FRESH = 0
+PRIORITY_BACKLOG = 1
+
+
+class Scheduler:
+    """
+    Планировщик операций с учётом квоты GitHub API.
+    Задачи хранятся в рабочем логе, поэтому переживают перезапуск. Если квоты на
+    операцию не хватает, задача ждёт сброса лимита, а неудачные попытки
+    повторяются с экспоненциальной задержкой.
+    """
+
+    def __init__(self, store, rate_budget, handlers, group_handlers=None):
+        """
+        rate_budget - функция, возвращающая (оставшиеся запросы, время сброса в секундах epoch).
+        handlers - словарь вид задачи -> функция от номера PR, возвращающая True при успехе.
+        group_handlers - словарь вид задачи -> функция от списка номеров PR, возвращающая
+        список успехов: все наступившие задачи такого вида выполняются одним вызовом.
+        """
+        self.logger = logging.getLogger("log")
+        self.store = store
+        self.rate_budget = rate_budget
+        self.handlers = handlers
+        self.group_handlers = group_handlers or {}
+        self.running = threading.Lock()
+
+    def cost(self, kind, count=1):
+        return config.operation_costs.get(kind, 1) * count
+
+    def available(self):
+        """
+        Возвращает (оставшиеся запросы, время сброса). После сброса лимита
+        сохранённый остаток устаревает, и квота считается полной.
+        """
+        requests_left, reset_time = self.rate_budget()
+        if requests_left is None or (reset_time and time.time() >= reset_time):
+            return None, reset_time
+        return requests_left, reset_time
+
+    def has_budget(self, kind, count=1):
+        requests_left, _ = self.available()
+        return requests_left is None or requests_left - self.cost(kind, count) >= config.rate_limit_reserve
+
+    def wait_for_budget(self, kind, count=1):
+        """
+        Блокирует выполнение до сброса лимита, если квоты на операцию не хватает.
+        """
+        if self.has_budget(kind, count):
+            return
+        _, reset_time = self.available()
+        wait = max(0, (reset_time or time.time()) - time.time()) + 1
+        self.logger.warning(f"Квота GitHub API исчерпана. Ожидание сброса лимита {wait:.0f} секунд.")
+        time.sleep(wait)
+
+    def submit(self, kind, number, fresh=True, delay=0):
+        priority = PRIORITY_FRESH if fresh else PRIORITY_BACKLOG
+        self.store.enqueue_task(kind, number, priority, time.time() + delay)
+
+    def run_pending(self):
+        """
+        Выполняет все задачи, срок которых наступил, пока хватает квоты.
+        Если очередь уже разбирается в другом потоке, ничего не делает.
+        """
+        if not self.running.acquire(blocking=False):
+            return
+        try:
+            self.run_due_tasks()
+        finally:
+            self.running.release()
+
+    def run_due_tasks(self):
+        while True:
+            task = self.store.next_task(time.time())
+            if task is None:
+                return
+            kind, number, attempts = task
+            if not self.has_budget(kind):
+                _, reset_time = self.available()
+                reset = datetime.fromtimestamp(reset_time, timezone.utc).strftime("%H:%M:%S") if reset_time else "?"
+                self.logger.warning(f"Мало оставшихся запросов к GitHub API. Задачи отложены до {reset} UTC.")
+                return
+            if kind in self.group_handlers:
+                self.run_group(kind)
+                continue
+            try:
+                succeeded = self.handlers[kind](number)
+            except Exception:
+                self.logger.exception(f"Ошибка при выполнении задачи {kind} #{number}.")
+                succeeded = False
+            self.finish(kind, number, attempts, succeeded)
+
+    def run_group(self, kind):
+        """
+        Выполняет наступившие задачи вида kind одним вызовом, сколько позволяет квота.
+        """
+        tasks = self.store.due_tasks(kind, time.time())
+        while len(tasks) > 1 and not self.has_budget(kind, len(tasks)):
+            tasks.pop()
+        numbers = [number for number, _ in tasks]
+        try:
+            results = self.group_handlers[kind](numbers)
+        except Exception:
+            self.logger.exception(f"Ошибка при выполнении задач {kind} {', '.join(f'#{n}' for n in numbers)}.")
+            results = [False] * len(tasks)
+        for (number, attempts), succeeded in zip(tasks, results):
+            self.finish(kind, number, attempts, succeeded)
+
+    def finish(self, kind, number, attempts, succeeded):
+        if succeeded:
+            self.store.remove_task(kind, number)
+        else:
+            self.retry_later(kind, number, attempts + 1)
+
+    def retry_later(self, kind, number, attempts):
+        if attempts >= config.retry_max_attempts:
+            self.logger.error(f"Задача {kind} #{number} не выполнена за {attempts} попыток и снята с очереди.")
+            self.store.remove_task(kind, number)
+            return
+        delay = min(config.retry_base_delay * 2 ** (attempts - 1), config.retry_max_delay)
+        self.logger.warning(f"Задача {kind} #{number} будет повторена через {delay} секунд (попытка {attempts}).")
+        self.store.reschedule_task(kind, number, attempts, time.time() + delay)
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class SqliteStateStore:
+    """
+    Хранилище рабочего лога на SQLite.
+    Проверки принадлежности идут по индексу, каждое изменение - атомарная транзакция.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.depth = 0
+        self.create_schema()
+
+    def create_schema(self):
+        with self.transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS processed_prs (number INTEGER PRIMARY KEY)")
+            db.execute("CREATE TABLE IF NOT EXISTS processing_prs ("
+                       "seq INTEGER PRIMARY KEY AUTOINCREMENT, number INTEGER NOT NULL UNIQUE)")
+            db.execute("CREATE TABLE IF NOT EXISTS task_queue ("
+                       "seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, number INTEGER NOT NULL, "
+                       "priority INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, due REAL NOT NULL, "
+                       "UNIQUE (kind, number))")
+            db.execute("CREATE INDEX IF NOT EXISTS task_queue_due ON task_queue (priority, due)")
+            db.execute("CREATE TABLE IF NOT EXISTS mirror_pulls ("
+                       "mirror_number INTEGER PRIMARY KEY, original_number INTEGER NOT NULL, title TEXT, "
+                       "merge_commit_sha TEXT NOT NULL, commit_shas TEXT NOT NULL DEFAULT '', "
+                       "branch TEXT NOT NULL, base_sha TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS mirror_batch_pulls ("
+                       "mirror_number INTEGER NOT NULL, position INTEGER NOT NULL, original_number INTEGER NOT NULL, "
+                       "title TEXT, merge_commit_sha TEXT NOT NULL, commit_shas TEXT NOT NULL DEFAULT '', "
+                       "PRIMARY KEY (mirror_number, position))")
+            db.execute("CREATE TABLE IF NOT EXISTS pull_progress ("
+                       "number INTEGER PRIMARY KEY, stage TEXT NOT NULL, merge_commit_sha TEXT, title TEXT, "
+                       "branch TEXT, head TEXT, base_sha TEXT, mirror_number INTEGER, conflicts TEXT, updated REAL NOT NULL)")
+            # Рабочие логи, созданные до появления столбца conflicts
+            columns = [row[1] for row in db.execute("PRAGMA table_info(pull_progress)")]
+            if "conflicts" not in columns:
+                db.execute("ALTER TABLE pull_progress ADD COLUMN conflicts TEXT")
+            db.execute("CREATE TABLE IF NOT EXISTS patch_ids (patch_id TEXT PRIMARY KEY, commit_sha TEXT NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS event_cursors ("
+                       "repo TEXT PRIMARY KEY, last_seen_id INTEGER NOT NULL, etag TEXT, updated REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS seen_events ("
+                       "repo TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (repo, id))")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Открывает транзакцию. Вложенные вызовы объединяются во внешнюю транзакцию,
+        что позволяет пакетно записывать изменения.
+        """
+        with self.lock:
+            if self.depth == 0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self.connection
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("COMMIT")
+
+    def is_initialized(self):
+        return self.get_meta("last_activation_day") is not None
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def add_processed_prs(self, pr_numbers):
+        with self.transaction() as db:
+            for pr_number in pr_numbers:
+                db.execute("INSERT OR IGNORE INTO processed_prs (number) VALUES (?)", (pr_number,))
+                db.execute("DELETE FROM processing_prs WHERE number = ?", (pr_number,))
+                db.execute("DELETE FROM pull_progress WHERE number = ?", (pr_number,))
+
+    def add_processing_prs(self, pr_numbers):
+        with self.transaction() as db:
+            for pr_number in pr_numbers:
+                db.execute("INSERT OR IGNORE INTO processing_prs (number) VALUES (?)", (pr_number,))
+
+    def is_processed(self, pr_number):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM processed_prs WHERE number = ?", (pr_number,)).fetchone()
+        return row is not None
+
+    def get_processing_prs(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT number FROM processing_prs ORDER BY seq").fetchall()
+        return [row[0] for row in rows]
+
+    def get_processed_prs(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT number FROM processed_prs").fetchall()
+        return [row[0] for row in rows]
+
+    def enqueue_task(self, kind, number, priority, due):
+        """
+        Ставит задачу в очередь. Если задача уже в очереди, повышает её приоритет
+        и срок выполнения, но не сбрасывает счётчик попыток.
+        """
+        with self.transaction() as db:
+            db.execute("INSERT INTO task_queue (kind, number, priority, due) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT (kind, number) DO UPDATE SET "
+                       "priority = MIN(priority, excluded.priority), due = MIN(due, excluded.due)",
+                       (kind, number, priority, due))
+
+    def next_task(self, now):
+        """
+        Возвращает (kind, number, attempts) самой приоритетной задачи, срок которой наступил.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT kind, number, attempts FROM task_queue WHERE due <= ? ORDER BY priority, seq LIMIT 1",
+                (now,)).fetchone()
+
+    def due_tasks(self, kind, now):
+        """
+        Возвращает (number, attempts) всех задач вида kind, срок которых наступил, по приоритету.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT number, attempts FROM task_queue WHERE kind = ? AND due <= ? ORDER BY priority, seq",
+                (kind, now)).fetchall()
+
+    def next_task_due(self):
+        with self.lock:
+            row = self.connection.execute("SELECT MIN(due) FROM task_queue").fetchone()
+        return row[0]
+
+    def count_tasks(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM task_queue").fetchone()[0]
+
+    def reschedule_task(self, kind, number, attempts, due):
+        with self.transaction() as db:
+            db.execute("UPDATE task_queue SET attempts = ?, due = ? WHERE kind = ? AND number = ?",
+                       (attempts, due, kind, number))
+
+    def remove_task(self, kind, number):
+        with self.transaction() as db:
+            db.execute("DELETE FROM task_queue WHERE kind = ? AND number = ?", (kind, number))
+
+    PROGRESS_FIELDS = ["merge_commit_sha", "title", "branch", "head", "base_sha", "mirror_number", "conflicts"]
+
+    def set_pr_progress(self, number, stage, artifacts):
+        """
+        Записывает этап зеркалирования PR. Незаданные артефакты сохраняют прежние значения.
+        """
+        values = [artifacts.get(field) for field in self.PROGRESS_FIELDS]
+        updates = ", ".join(f"{field} = COALESCE(excluded.{field}, {field})" for field in self.PROGRESS_FIELDS)
+        with self.transaction() as db:
+            db.execute(f"INSERT INTO pull_progress (number, stage, {', '.join(self.PROGRESS_FIELDS)}, updated) "
+                       f"VALUES (?, ?, {', '.join('?' * len(values))}, ?) "
+                       f"ON CONFLICT (number) DO UPDATE SET stage = excluded.stage, updated = excluded.updated, "
+                       f"{updates}",
+                       (number, stage, *values, time.time()))
+
+    def get_pr_progress(self, number):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT number, stage, {', '.join(self.PROGRESS_FIELDS)} FROM pull_progress WHERE number = ?",
+                (number,)).fetchone()
+        return dict(zip(["number", "stage", *self.PROGRESS_FIELDS], row)) if row else None
+
+    def get_unfinished_prs(self):
+        """
+        Возвращает этапы всех PR, зеркалирование которых начато, но не завершено.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT number, stage, {', '.join(self.PROGRESS_FIELDS)} FROM pull_progress ORDER BY number"
+            ).fetchall()
+        return [dict(zip(["number", "stage", *self.PROGRESS_FIELDS], row)) for row in rows]
+
+    def add_mirror_pull(self, mirror_number, original_number, title, merge_commit_sha, commit_shas, branch,
+                        base_sha):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO mirror_pulls (mirror_number, original_number, title, "
+                       "merge_commit_sha, commit_shas, branch, base_sha) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (mirror_number, original_number, title, merge_commit_sha, " ".join(commit_shas), branch,
+                        base_sha))
+
+    def get_mirror_pull(self, mirror_number):
+        """
+        Возвращает словарь с данными PR предка, зеркалом которого является PR потомка, или None.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT original_number, title, merge_commit_sha, commit_shas, branch, base_sha "
+                "FROM mirror_pulls WHERE mirror_number = ?", (mirror_number,)).fetchone()
+            batch = self.connection.execute(
+                "SELECT original_number, title, merge_commit_sha, commit_shas FROM mirror_batch_pulls "
+                "WHERE mirror_number = ? ORDER BY position", (mirror_number,)).fetchall()
+        if row is None:
+            return None
+        keys = ["original_number", "title", "merge_commit_sha", "commit_shas", "branch", "base_sha"]
+        mapping = dict(zip(keys, row))
+        mapping["commit_shas"] = mapping["commit_shas"].split()
+        # PR пакетного режима: исходные PR в порядке переноса на ветку
+        mapping["batch"] = [dict(zip(keys, (*item[:3], item[3].split()))) for item in batch]
+        return mapping
+
+    def add_batch_pull(self, mirror_number, title, pulls, branch, base_sha):
+        """
+        Запоминает PR пакета. pulls - кортежи (номер, заголовок, коммит слияния, коммиты)
+        в порядке переноса; первый PR записывается и в общую таблицу соответствия.
+        """
+        number, _, merge_commit_sha, commit_shas = pulls[0]
+        with self.transaction() as db:
+            self.add_mirror_pull(mirror_number, number, title, merge_commit_sha, commit_shas, branch, base_sha)
+            db.execute("DELETE FROM mirror_batch_pulls WHERE mirror_number = ?", (mirror_number,))
+            db.executemany("INSERT INTO mirror_batch_pulls (mirror_number, position, original_number, title, "
+                           "merge_commit_sha, commit_shas) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(mirror_number, position, number, title, merge_commit_sha, " ".join(commit_shas))
+                            for position, (number, title, merge_commit_sha, commit_shas) in enumerate(pulls)])
+
+    def update_mirror_base(self, mirror_number, base_sha):
+        with self.transaction() as db:
+            db.execute("UPDATE mirror_pulls SET base_sha = ? WHERE mirror_number = ?", (base_sha, mirror_number))
+
+    def add_patch_ids(self, rows):
+        """
+        Добавляет пары (patch-id, коммит) в индекс. Для уже известного patch-id
+        сохраняется первый найденный коммит.
+        """
+        with self.transaction() as db:
+            db.executemany("INSERT OR IGNORE INTO patch_ids (patch_id, commit_sha) VALUES (?, ?)", rows)
+
+    def find_patch_id(self, patch_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT commit_sha FROM patch_ids WHERE patch_id = ?", (patch_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_event_cursor(self, repo):
+        """
+        Возвращает (последнее обработанное событие, ETag) ленты репозитория или None.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT last_seen_id, etag FROM event_cursors WHERE repo = ?", (repo,)).fetchone()
+
+    def set_event_cursor(self, repo, last_seen_id, etag, keep_seen):
+        """
+        Сохраняет положение в ленте и оставляет в окне обработанных событий
+        только keep_seen последних.
+        """
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO event_cursors (repo, last_seen_id, etag, updated) "
+                       "VALUES (?, ?, ?, ?)", (repo, last_seen_id, etag, time.time()))
+            db.execute("DELETE FROM seen_events WHERE repo = ? AND id NOT IN "
+                       "(SELECT id FROM seen_events WHERE repo = ? ORDER BY id DESC LIMIT ?)",
+                       (repo, repo, keep_seen))
+
+    def add_seen_event(self, repo, event_id):
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO seen_events (repo, id) VALUES (?, ?)", (repo, event_id))
+
+    def is_event_seen(self, repo, event_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM seen_events WHERE repo = ? AND id = ?", (repo, event_id)).fetchone()
+        return row is not None
+
+    def import_work_log(self, data):
+        """
+        Переносит содержимое старого JSON лога одной транзакцией.
+        """
+        with self.transaction():
+            if data.get("last_activation_day"):
+                self.set_meta("last_activation_day", data["last_activation_day"])
+            self.add_processed_prs(data.get("processed_prs", []))
+            self.add_processing_prs(data.get("processing_prs", []))
+
+
+def open_store(backend, path, legacy_path=None):
+    """
+    Открывает хранилище рабочего лога выбранного типа.
+    При первом запуске SQLite хранилища переносит данные из старого JSON файла.
+    """
+    logger = logging.getLogger("log")
+    if backend != "sqlite":
+        raise ValueError(f"Неизвестный тип хранилища рабочего лога: {backend}")
+
+    store = SqliteStateStore(path)
+    if legacy_path and os.path.exists(legacy_path) and not store.is_initialized():
+        logger.info(f"Перенос рабочего лога из {legacy_path} в {path}.")
+        with open(legacy_path, 'r') as f:
+            store.import_work_log(json.load(f))
+        os.replace(legacy_path, f"{legacy_path}.migrated")
+    return store
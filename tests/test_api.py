@@ -0,0 +1,95 @@
+import unittest
+import api
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None, links=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.links = links or {}
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeSession:
+    """
+    Отдаёт заранее заданные ответы по порядку и запоминает запросы.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append((method, url, dict(headers or {})))
+        return self.responses.pop(0)
+
+
+def events(*ids):
+    return [{"id": str(event_id), "type": "PullRequestEvent", "payload": {}} for event_id in ids]
+
+
+class PollEventsTest(unittest.TestCase):
+    def client(self, responses):
+        client = api.GithubClient("https://api.test")
+        client.session = FakeSession(responses)
+        return client
+
+    def test_not_modified(self):
+        client = self.client([FakeResponse(304, headers={"X-Poll-Interval": "60"})])
+        new_events, poll = client.poll_events("owner/repo", 10, etag='"etag"')
+        self.assertEqual(new_events, [])
+        self.assertTrue(poll.not_modified)
+        self.assertEqual(poll.etag, '"etag"')
+        self.assertEqual(poll.poll_interval, 60)
+        self.assertEqual(client.session.requests[0][2]["If-None-Match"], '"etag"')
+
+    def test_stops_at_seen_event(self):
+        next_page = {"next": {"url": "https://api.test/repos/owner/repo/events?per_page=100&page=2"},
+                     "last": {"url": "https://api.test/repos/owner/repo/events?per_page=100&page=3"}}
+        client = self.client([
+            FakeResponse(200, events(15, 14, 13), {"ETag": '"new"'}, next_page),
+            FakeResponse(200, events(12, 11, 10, 9), {}, next_page),
+            FakeResponse(200, events(8, 7))
+        ])
+        new_events, poll = client.poll_events("owner/repo", 10, etag='"old"')
+        self.assertEqual([int(event.id) for event in new_events], [11, 12, 13, 14, 15])
+        self.assertTrue(poll.reached_seen)
+        self.assertEqual(poll.pages, 2)
+        self.assertEqual(poll.total_pages, 3)
+        self.assertEqual(poll.etag, '"new"')
+        # Третья страница не запрашивается, ETag передаётся только с первой
+        self.assertEqual(len(client.session.requests), 2)
+        self.assertNotIn("If-None-Match", client.session.requests[1][2])
+
+    def test_feed_ends_before_seen_event(self):
+        client = self.client([FakeResponse(200, events(15, 14))])
+        new_events, poll = client.poll_events("owner/repo", 10)
+        self.assertEqual([int(event.id) for event in new_events], [14, 15])
+        self.assertFalse(poll.reached_seen)
+
+    def test_max_pages(self):
+        next_page = {"next": {"url": "https://api.test/repos/owner/repo/events?page=2"}}
+        client = self.client([FakeResponse(200, events(5, 4), {}, next_page)])
+        new_events, poll = client.poll_events("owner/repo", None, max_pages=1)
+        self.assertEqual([int(event.id) for event in new_events], [4, 5])
+        self.assertEqual(len(client.session.requests), 1)
+
+
+class EndpointTemplateTest(unittest.TestCase):
+    def test_templates(self):
+        self.assertEqual(api.endpoint_template("https://api.github.com/repos/owner/repo/pulls/12/commits?page=2"),
+                         "/repos/{owner}/{repo}/pulls/{number}/commits")
+        self.assertEqual(api.endpoint_template("https://api.github.com/repos/owner/repo/events"),
+                         "/repos/{owner}/{repo}/events")
+        self.assertEqual(api.endpoint_template("https://api.github.com/graphql"), "/graphql")
+
+
+if __name__ == '__main__':
+    unittest.main()
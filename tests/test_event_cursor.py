@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import api
+import state
+from event_cursor import EventCursor
+from tests.test_api import FakeResponse, FakeSession, events
+
+
+class Repo:
+    full_name = "owner/repo"
+    html_url = "https://github.test/owner/repo"
+
+
+class EventCursorTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.repo = Repo()
+
+    def store(self, name, last_seen_id=None, etag=None):
+        store = state.SqliteStateStore(os.path.join(self.directory, name))
+        self.addCleanup(store.connection.close)
+        if last_seen_id is not None:
+            store.set_event_cursor(self.repo.html_url, last_seen_id, etag, 1000)
+        return store
+
+    def client(self, responses):
+        client = api.GithubClient("https://api.test")
+        client.session = FakeSession(responses)
+        return client
+
+    def test_resume_reaches_saved_event(self):
+        cursor = EventCursor()
+        cursor.attach(self.repo, self.store("a.db", 10, '"old"'))
+        client = self.client([FakeResponse(200, events(13, 12, 11, 10, 9), {"ETag": '"new"'})])
+        self.assertTrue(cursor.resume(client, self.repo))
+        self.assertEqual([int(event.id) for event in cursor.take_pending(self.repo)], [11, 12, 13])
+        self.assertEqual(cursor.etags[self.repo.html_url], '"new"')
+        # Повторный вызов не запрашивает ленту
+        self.assertTrue(cursor.resume(client, self.repo))
+        self.assertEqual(len(client.session.requests), 1)
+
+    def test_stale_cursor(self):
+        cursor = EventCursor()
+        cursor.attach(self.repo, self.store("a.db", 10))
+        # Лента уже не содержит события 10: между ним и 14 могли быть пропущены слияния
+        client = self.client([FakeResponse(200, events(15, 14))])
+        self.assertFalse(cursor.resume(client, self.repo))
+        self.assertEqual([int(event.id) for event in cursor.take_pending(self.repo)], [14, 15])
+
+    def test_resumes_from_earliest_store(self):
+        cursor = EventCursor()
+        cursor.attach(self.repo, self.store("a.db", 20, '"later"'))
+        cursor.attach(self.repo, self.store("b.db", 10, '"earlier"'))
+        client = self.client([FakeResponse(200, events(21, 20, 15, 10))])
+        self.assertTrue(cursor.resume(client, self.repo))
+        self.assertEqual(client.session.requests[0][2]["If-None-Match"], '"earlier"')
+        self.assertEqual([int(event.id) for event in cursor.take_pending(self.repo)], [15, 20, 21])
+
+    def test_store_without_cursor(self):
+        # Положение не сохранено в одном из логов: ленту по нему не дочитать
+        cursor = EventCursor()
+        cursor.attach(self.repo, self.store("a.db", 10))
+        cursor.attach(self.repo, self.store("b.db"))
+        client = self.client([])
+        self.assertFalse(cursor.resume(client, self.repo))
+        self.assertEqual(client.session.requests, [])
+
+    def test_is_seen(self):
+        cursor = EventCursor()
+        first = self.store("a.db", 10)
+        cursor.attach(self.repo, first)
+        cursor.attach(self.repo, self.store("b.db", 10))
+        handled, fresh = api.Event(events(11)[0]), api.Event(events(12)[0])
+        cursor.handled(self.repo, handled)
+        self.assertTrue(cursor.is_seen(self.repo, handled))
+        self.assertFalse(cursor.is_seen(self.repo, fresh))
+        # Событие, записанное только в одном логе, тоже считается обработанным
+        first.add_seen_event(self.repo.html_url, 12)
+        self.assertTrue(cursor.is_seen(self.repo, fresh))
+
+
+if __name__ == '__main__':
+    unittest.main()
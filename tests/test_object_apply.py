@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+import object_apply
+from gitcmd import run_git, git_output
+
+
+class ObjectApplyTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        run_git(self.workdir, "init", "-q", "-b", "master", check=True)
+        run_git(self.workdir, "config", "user.name", "Test", check=True)
+        run_git(self.workdir, "config", "user.email", "test@example.com", check=True)
+        self.base = self.commit("file.txt", "one\ntwo\nthree\n", "base")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def commit(self, name, content, message):
+        with open(os.path.join(self.workdir, name), "w") as file:
+            file.write(content)
+        run_git(self.workdir, "add", name, check=True)
+        run_git(self.workdir, "commit", "-q", "-m", message, check=True)
+        return git_output(self.workdir, "rev-parse", "HEAD")
+
+    def show(self, commit, name):
+        return git_output(self.workdir, "show", f"{commit}:{name}")
+
+    def test_clean_pick(self):
+        # Потомок изменил другой файл, изменение предка переносится без конфликта
+        run_git(self.workdir, "checkout", "-q", "-b", "downstream", check=True)
+        downstream = self.commit("other.txt", "downstream\n", "downstream change")
+        run_git(self.workdir, "checkout", "-q", "master", check=True)
+        change = self.commit("file.txt", "one\nTWO\nthree\n", "upstream change")
+
+        head, conflicted = object_apply.pick_commit(self.workdir, downstream, change)
+
+        self.assertFalse(conflicted)
+        self.assertEqual(object_apply.commit_parents(self.workdir, head), [downstream])
+        self.assertEqual(self.show(head, "file.txt"), "one\nTWO\nthree")
+        self.assertEqual(self.show(head, "other.txt"), "downstream")
+        self.assertEqual(git_output(self.workdir, "log", "-1", "--format=%s", head), "upstream change")
+
+    def test_conflicting_pick(self):
+        run_git(self.workdir, "checkout", "-q", "-b", "downstream", check=True)
+        downstream = self.commit("file.txt", "one\nDOWN\nthree\n", "downstream change")
+        run_git(self.workdir, "checkout", "-q", "master", check=True)
+        change = self.commit("file.txt", "one\nUP\nthree\n", "upstream change")
+
+        head, conflicts = object_apply.mirror_commit(self.workdir, downstream, change, "title", [], "mirror")
+
+        # Коммит создаётся вместе с маркерами конфликта, как в worktree-движке
+        self.assertEqual(conflicts, [change])
+        self.assertEqual(git_output(self.workdir, "rev-parse", "mirror"), head)
+        self.assertIn("<<<<<<<", self.show(head, "file.txt"))
+
+    def test_fast_forward_pulls_are_picked_per_commit(self):
+        # PR влит перемоткой: коммит слияния - последний коммит PR
+        first = self.commit("a.txt", "a\n", "first")
+        second = self.commit("b.txt", "b\n", "second")
+        run_git(self.workdir, "checkout", "-q", "-b", "downstream", self.base, check=True)
+        downstream = self.commit("other.txt", "downstream\n", "downstream change")
+
+        head, conflicts = object_apply.mirror_commit(self.workdir, downstream, second, "title",
+                                                     [first, second], "mirror")
+
+        self.assertEqual(conflicts, [])
+        messages = git_output(self.workdir, "log", "--format=%s", f"{downstream}..{head}").splitlines()
+        self.assertEqual(messages, ["second", "first"])
+        self.assertEqual(self.show(head, "a.txt"), "a")
+        self.assertEqual(self.show(head, "b.txt"), "b")
+        self.assertEqual(self.show(head, "other.txt"), "downstream")
+
+
+if __name__ == '__main__':
+    unittest.main()
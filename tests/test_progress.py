@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import progress
+import state
+import tools
+
+
+class MirrorPull:
+    def __init__(self, number):
+        self.number = number
+
+
+class Downstream:
+    """
+    Потомок с заранее заданными открытыми PR по веткам.
+    """
+    full_name = "owner/downstream"
+
+    def __init__(self, pulls=None):
+        self.pulls = pulls or {}
+        self.heads = []
+
+    def get_pulls(self, state, head):
+        self.heads.append(head)
+        branch = head.split(":", 1)[1]
+        return [self.pulls[branch]] if branch in self.pulls else []
+
+
+class RecoverTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = state.SqliteStateStore(os.path.join(directory.name, "state.db"))
+        self.addCleanup(self.store.connection.close)
+        # Вершины веток в потомке и коммиты, которые есть в локальном клоне
+        self.remote = {}
+        self.local_commits = {"head1"}
+        for target, stub in (("progress.remote_branches", lambda workdir: self.remote),
+                             ("fetch.has_commit", lambda workdir, sha: sha in self.local_commits)):
+            patcher = mock.patch(target, stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start(self, stage, head="head1"):
+        progress.record(self.store, 1, progress.FETCHED, merge_commit_sha="merge1", title="Title")
+        if stage != progress.FETCHED:
+            progress.record(self.store, 1, progress.APPLIED, branch="upstream-merge-1", head=head, base_sha="base1")
+        if stage == progress.PUSHED:
+            progress.record(self.store, 1, progress.PUSHED)
+
+    def test_applied_branch_found_in_downstream(self):
+        self.start(progress.APPLIED)
+        self.remote = {"upstream-merge-1": "head1"}
+        downstream = Downstream()
+        progress.recover(self.store, downstream, "workdir")
+        self.assertEqual(progress.get(self.store, 1)["stage"], progress.PUSHED)
+        self.assertEqual(downstream.heads, ["owner:upstream-merge-1"])
+
+    def test_pushed_branch_missing_in_downstream(self):
+        self.start(progress.PUSHED)
+        self.remote = {"upstream-merge-1": "other"}
+        progress.recover(self.store, Downstream(), "workdir")
+        self.assertEqual(progress.get(self.store, 1)["stage"], progress.APPLIED)
+
+    def test_missing_local_commit_is_rebuilt(self):
+        self.start(progress.PUSHED, head="lost")
+        progress.recover(self.store, Downstream(), "workdir")
+        self.assertEqual(progress.get(self.store, 1)["stage"], progress.FETCHED)
+
+    def test_adopts_existing_pull(self):
+        # PR потомка создан, но ответ на запрос не дошёл
+        self.start(progress.PUSHED)
+        self.remote = {"upstream-merge-1": "head1"}
+        progress.recover(self.store, Downstream({"upstream-merge-1": MirrorPull(7)}), "workdir")
+        self.assertTrue(tools.check_processed_pr(self.store, 1))
+        mapping = tools.get_mirror_pull(self.store, 7)
+        self.assertEqual((mapping["original_number"], mapping["merge_commit_sha"], mapping["branch"],
+                          mapping["base_sha"]), (1, "merge1", "upstream-merge-1", "base1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
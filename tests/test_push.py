@@ -0,0 +1,38 @@
+import unittest
+import push
+
+
+class ParsePorcelainTest(unittest.TestCase):
+    def test_landed_and_rejected(self):
+        output = ("To github.com:owner/repo.git\n"
+                  "*\tabc:refs/heads/upstream-merge-1\t[new branch]\n"
+                  " \tdef:refs/heads/upstream-merge-2\t1111111..2222222\n"
+                  "+\tdef:refs/heads/upstream-merge-3\t1111111...2222222 (forced update)\n"
+                  "=\tdef:refs/heads/upstream-merge-4\t[up to date]\n"
+                  "!\tdef:refs/heads/upstream-merge-5\t[rejected] (fetch first)\n"
+                  "Done\n")
+        branches = [f"upstream-merge-{number}" for number in range(1, 6)]
+        self.assertEqual(push.parse_porcelain(output, branches), {
+            "upstream-merge-1": True,
+            "upstream-merge-2": True,
+            "upstream-merge-3": True,
+            "upstream-merge-4": True,
+            "upstream-merge-5": False
+        })
+
+    def test_missing_branch_is_not_landed(self):
+        # Например, git push завершился до согласования ссылок
+        self.assertEqual(push.parse_porcelain("fatal: unable to access\n", ["upstream-merge-1"]),
+                         {"upstream-merge-1": False})
+
+    def test_ignores_unknown_refs(self):
+        output = "*\tabc:refs/heads/other\t[new branch]\n"
+        self.assertEqual(push.parse_porcelain(output, ["upstream-merge-1"]), {"upstream-merge-1": False})
+
+    def test_push_arguments(self):
+        self.assertEqual(push.push_arguments({"b1": "sha1", "b2": "sha2"}, force=True, atomic=True),
+                         ["push", "--porcelain", "--atomic", "downstream", "+sha1:refs/heads/b1", "+sha2:refs/heads/b2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
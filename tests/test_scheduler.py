@@ -0,0 +1,106 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+import config
+import state
+import scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = state.SqliteStateStore(os.path.join(directory.name, "state.db"))
+        self.addCleanup(self.store.connection.close)
+        # Остаток квоты и время сброса, которые видит планировщик
+        self.budget = (None, None)
+        self.calls = []
+        for name, value in {"operation_costs": {"mirror": 3, "batch": 3}, "rate_limit_reserve": 10,
+                            "retry_base_delay": 60, "retry_max_delay": 3600, "retry_max_attempts": 3}.items():
+            patcher = mock.patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def scheduler(self, result=True, group_result=None):
+        def handle(number):
+            self.calls.append(number)
+            return result
+
+        def handle_group(numbers):
+            self.calls.append(numbers)
+            if self.budget[0] is not None:
+                # Вызов расходует квоту, как настоящие запросы
+                self.budget = (self.budget[0] - 3 * len(numbers), self.budget[1])
+            return group_result(numbers)
+
+        group_handlers = {"batch": handle_group} if group_result else None
+        return scheduler.Scheduler(self.store, lambda: self.budget, {"mirror": handle}, group_handlers)
+
+    def tasks(self):
+        return self.store.connection.execute(
+            "SELECT kind, number, attempts, due FROM task_queue ORDER BY seq").fetchall()
+
+    def test_fresh_tasks_run_before_backlog(self):
+        tasks = self.scheduler()
+        tasks.submit("mirror", 1, fresh=False)
+        tasks.submit("mirror", 2, fresh=False)
+        tasks.submit("mirror", 3)
+        tasks.run_pending()
+        self.assertEqual(self.calls, [3, 1, 2])
+        self.assertEqual(self.tasks(), [])
+
+    def test_failed_task_backs_off_exponentially(self):
+        tasks = self.scheduler(result=False)
+        tasks.submit("mirror", 1)
+        for attempts, delay in ((1, 60), (2, 120)):
+            start = time.time()
+            tasks.run_pending()
+            [(_, _, recorded, due)] = self.tasks()
+            self.assertEqual(recorded, attempts)
+            self.assertAlmostEqual(due - start, delay, delta=5)
+            # Срок повтора наступил
+            self.store.reschedule_task("mirror", 1, attempts, 0)
+        # Третья неудачная попытка - предел retry_max_attempts, задача снимается
+        tasks.run_pending()
+        self.assertEqual(self.calls, [1, 1, 1])
+        self.assertEqual(self.tasks(), [])
+
+    def test_backoff_is_capped(self):
+        tasks = self.scheduler()
+        tasks.submit("mirror", 1)
+        with mock.patch.object(config, "retry_max_attempts", 20):
+            start = time.time()
+            tasks.retry_later("mirror", 1, 10)
+        [(_, _, _, due)] = self.tasks()
+        self.assertAlmostEqual(due - start, 3600, delta=5)
+
+    def test_tasks_wait_for_budget(self):
+        tasks = self.scheduler()
+        tasks.submit("mirror", 1)
+        # 12 - 3 меньше запаса в 10 запросов
+        self.budget = (12, time.time() + 600)
+        tasks.run_pending()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(self.tasks()), 1)
+        # После сброса лимита сохранённый остаток устаревает
+        self.budget = (12, time.time() - 1)
+        tasks.run_pending()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(self.tasks(), [])
+
+    def test_group_is_trimmed_to_budget(self):
+        tasks = self.scheduler(group_result=lambda numbers: [number != 2 for number in numbers])
+        for number in (1, 2, 3, 4):
+            tasks.submit("batch", number)
+        # Хватает на два PR: 16 - 2 * 3 >= 10
+        self.budget = (16, time.time() + 600)
+        tasks.run_due_tasks()
+        self.assertEqual(self.calls, [[1, 2]])
+        # Неудачный PR повторяется позже, оставшиеся ждут квоты
+        self.assertEqual([(number, attempts) for _, number, attempts, _ in self.tasks()], [(2, 1), (3, 0), (4, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
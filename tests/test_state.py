@@ -0,0 +1,80 @@
+import os
+import json
+import tempfile
+import unittest
+import state
+
+
+class OpenStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, "state.db")
+        self.legacy_path = os.path.join(directory.name, "work_log.json")
+
+    def open_store(self):
+        store = state.open_store("sqlite", self.db_path, self.legacy_path)
+        self.addCleanup(store.connection.close)
+        return store
+
+    def write_legacy(self, data):
+        with open(self.legacy_path, 'w') as f:
+            json.dump(data, f)
+
+    def test_migrates_json_work_log(self):
+        self.write_legacy({"last_activation_day": "2024-01-02T03:04:05Z",
+                           "processed_prs": [1, 2], "processing_prs": [3, 4]})
+        store = self.open_store()
+        self.assertEqual(store.get_meta("last_activation_day"), "2024-01-02T03:04:05Z")
+        self.assertEqual(sorted(store.get_processed_prs()), [1, 2])
+        self.assertEqual(store.get_processing_prs(), [3, 4])
+        # Старый файл переименовывается, чтобы не переноситься повторно
+        self.assertFalse(os.path.exists(self.legacy_path))
+        self.assertTrue(os.path.exists(f"{self.legacy_path}.migrated"))
+
+    def test_does_not_migrate_into_initialized_store(self):
+        self.write_legacy({"last_activation_day": "2024-01-02T03:04:05Z", "processed_prs": [1]})
+        self.open_store()
+        self.write_legacy({"last_activation_day": "2025-01-01T00:00:00Z", "processed_prs": [7]})
+        store = self.open_store()
+        self.assertEqual(store.get_meta("last_activation_day"), "2024-01-02T03:04:05Z")
+        self.assertEqual(store.get_processed_prs(), [1])
+        self.assertTrue(os.path.exists(self.legacy_path))
+
+    def test_without_legacy_file(self):
+        store = self.open_store()
+        self.assertFalse(store.is_initialized())
+        self.assertEqual(store.get_processed_prs(), [])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            state.open_store("json", self.db_path)
+
+
+class MirrorPullTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = state.SqliteStateStore(os.path.join(directory.name, "state.db"))
+        self.addCleanup(self.store.connection.close)
+
+    def test_single_pull(self):
+        self.store.add_mirror_pull(10, 5, "Title", "abc", ["c1", "c2"], "upstream-merge-5", "base")
+        mapping = self.store.get_mirror_pull(10)
+        self.assertEqual(mapping["original_number"], 5)
+        self.assertEqual(mapping["commit_shas"], ["c1", "c2"])
+        self.assertEqual(mapping["batch"], [])
+        self.assertIsNone(self.store.get_mirror_pull(11))
+
+    def test_batch_pull(self):
+        self.store.add_batch_pull(20, "Upstream merges #1-#2", [(1, "One", "m1", ["c1"]), (2, "Two", "m2", [])],
+                                  "upstream-merge-batch-1-2", "base")
+        mapping = self.store.get_mirror_pull(20)
+        self.assertEqual(mapping["branch"], "upstream-merge-batch-1-2")
+        self.assertEqual([item["original_number"] for item in mapping["batch"]], [1, 2])
+        self.assertEqual(mapping["batch"][0]["commit_shas"], ["c1"])
+        self.assertEqual(mapping["batch"][1]["commit_shas"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+import http.client
+import webhook
+
+
+class VerifySignatureTest(unittest.TestCase):
+    def test_signature(self):
+        body = b'{"zen": "Keep it logically awesome."}'
+        signature = webhook.sign("secret", body)
+        self.assertTrue(signature.startswith("sha256="))
+        self.assertTrue(webhook.verify_signature("secret", body, signature))
+        self.assertFalse(webhook.verify_signature("other", body, signature))
+        self.assertFalse(webhook.verify_signature("secret", body + b" ", signature))
+        self.assertFalse(webhook.verify_signature("secret", body, None))
+
+
+class AcceptTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver = webhook.WebhookReceiver("secret", "127.0.0.1", 0)
+
+    def accept(self, body, delivery_id="d1", event_name="pull_request"):
+        return self.receiver.accept(event_name, delivery_id, webhook.sign("secret", body), body)
+
+    def test_queues_event_once(self):
+        body = json.dumps({"action": "closed", "repository": {"full_name": "owner/repo"}}).encode()
+        self.assertEqual(self.accept(body), 202)
+        self.assertEqual(self.accept(body), 200)
+        full_name, event = self.receiver.queue.get_nowait()
+        self.assertEqual(full_name, "owner/repo")
+        self.assertEqual(event.type, "PullRequestEvent")
+        self.assertTrue(self.receiver.queue.empty())
+
+    def test_rejects_bad_signature(self):
+        self.assertEqual(self.receiver.accept("pull_request", "d1", "sha256=0", b"{}"), 401)
+
+    def test_rejects_invalid_payload(self):
+        self.assertEqual(self.accept(b"{"), 400)
+        self.assertEqual(self.accept(b'{"action": "closed"}'), 400)
+        # Неверная доставка не запоминается, исправленный повтор принимается
+        body = json.dumps({"repository": {"full_name": "owner/repo"}}).encode()
+        self.assertEqual(self.accept(body), 202)
+
+    def test_ping_and_unknown_events(self):
+        self.assertEqual(self.accept(b"{}", event_name="ping"), 200)
+        self.assertEqual(self.accept(b"{}", event_name="push"), 202)
+        self.assertTrue(self.receiver.queue.empty())
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver = webhook.WebhookReceiver("secret", "127.0.0.1", 0)
+        self.receiver.start()
+        self.addCleanup(self.receiver.stop)
+
+    def post(self, content_length, body=b""):
+        connection = http.client.HTTPConnection("127.0.0.1", self.receiver.server.server_address[1], timeout=5)
+        self.addCleanup(connection.close)
+        connection.putrequest("POST", "/")
+        connection.putheader("X-GitHub-Event", "ping")
+        connection.putheader("X-Hub-Signature-256", webhook.sign("secret", body))
+        if content_length is not None:
+            connection.putheader("Content-Length", content_length)
+        connection.endheaders(body)
+        return connection.getresponse().status
+
+    def test_checks_content_length_before_reading(self):
+        self.assertEqual(self.post("2", b"{}"), 200)
+        self.assertEqual(self.post(None), 400)
+        self.assertEqual(self.post("abc"), 400)
+        self.assertEqual(self.post("-1"), 400)
+        # Тело не отправляется: ответ приходит без попытки его прочитать
+        self.assertEqual(self.post(str(webhook.MAX_BODY_SIZE + 1)), 413)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,204 +1,123 @@
-import subprocess
-import sys
 import config
-import os
-import json
-from datetime import datetime
-import logging
+import state
 
 
-def is_gh_installed():
-    try:
-        # Попытка вызвать gh --version
-        subprocess.run(['gh', '--version'], check=True,
-                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+_stores = {}
 
 
-def is_gh_logged():
-    try:
-        completed = subprocess.run(
-            ["gh", "auth", "status", "--hostname",
-                "github.com"],  # hostname опционален
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        return completed.returncode == 0
-    except subprocess.CalledProcessError:
-        return False
+def get_store(state_db_file, work_log_file=None):
+    """
+    Возвращает открытое хранилище рабочего лога пары репозиториев,
+    открывая его при первом обращении.
+    """
+    if state_db_file not in _stores:
+        _stores[state_db_file] = state.open_store(config.work_log_backend, state_db_file, work_log_file)
+    return _stores[state_db_file]
+
+
+def work_log_exists(store):
+    return store.is_initialized()
 
 
-def initialize_work_log(last_activation_day):
-    if not os.path.exists(config.work_log_file):
-        data = {
-            "last_activation_day": last_activation_day,
-            "processed_prs": [],
-            "processing_prs": []
-        }
-        with open(config.work_log_file, 'w') as f:
-            json.dump(data, f, indent=4)
+def initialize_work_log(store, last_activation_day):
+    if not store.is_initialized():
+        store.set_meta("last_activation_day", last_activation_day)
 
 
-def read_work_log():
+def get_last_activation_day(store):
     """
-    Читает и возвращает содержимое файла конфигурации.
+    Возвращает дату последней активации из рабочего лога.
+    Если дата отсутствует, возвращает None.
     """
-    with open(config.work_log_file, 'r') as f:
-        return json.load(f)
+    return store.get_meta("last_activation_day")
 
 
-def write_work_log(data):
+def update_activation_day(store, last_activation_day):
     """
-    Записывает данные в файл конфигурации.
+    Обновляет дату последней активации на текущую дату.
     """
-    with open(config.work_log_file, 'w') as f:
-        json.dump(data, f, indent=4)
+    store.set_meta("last_activation_day", last_activation_day)
 
 
-def get_last_activation_day():
+def add_processed_pr(store, pr_number):
     """
-    Читает дату последней активации из файла и возвращает объект datetime.
-    Если дата отсутствует или файл не существует, возвращает None.
+    Добавляет номер PR в список обработанных PR.
     """
-    try:
-        data = read_work_log()
-        date_str = data.get('last_activation_day')
-        if date_str:
-            return date_str
-        else:
-            return None
-    except (FileNotFoundError, json.JSONDecodeError):
-        return None
+    store.add_processed_prs([pr_number])
 
 
-def update_activation_day(last_activation_day):
+def add_processed_prs(store, pr_numbers):
     """
-    Обновляет дату последней активации на текущую дату.
+    Добавляет несколько PR в список обработанных одной транзакцией.
     """
-    data = read_work_log()
-    data['last_activation_day'] = last_activation_day
-    write_work_log(data)
+    store.add_processed_prs(pr_numbers)
 
 
-def add_processed_pr(pr_number):
+def add_processing_prs(store, processing_prs):
+    store.add_processing_prs(processing_prs)
+
+
+def add_processing_pr(store, processing_pr):
+    store.add_processing_prs([processing_pr])
+
+
+def check_processed_pr(store, pr_number):
+    return store.is_processed(pr_number)
+
+
+def get_processing_prs(store):
     """
-    Добавляет номер PR в список обработанных PR.
+    Возвращает список PR, ожидающих зеркалирования.
     """
-    data = read_work_log()
-    if pr_number not in data['processed_prs']:
-        data['processed_prs'].append(pr_number)
-    if pr_number in data['processing_prs']:
-        data['processing_prs'].remove(pr_number)
-    write_work_log(data)
+    return store.get_processing_prs()
 
 
-def add_processing_prs(processing_prs):
-    data = read_work_log()
-    for pr_number in processing_prs:
-        if pr_number not in data['processing_prs']:
-            data['processing_prs'].append(pr_number)
-    write_work_log(data)
+def get_processed_prs(store):
+    """
+    Возвращает список обработанных PR.
+    """
+    return store.get_processed_prs()
 
-    
-def add_processing_pr(processing_pr):
-    data = read_work_log()
-    data['processing_prs'].append(processing_pr)
-    write_work_log(data)
 
+def add_mirror_pull(store, mirror_number, original_pull, branch, base_sha):
+    """
+    Запоминает, зеркалом какого PR предка является PR потомка, чтобы remirror
+    не разбирал описание PR и не запрашивал PR предка заново.
+    Список коммитов сохраняется, только если он уже загружен: пустой список в таблице
+    означает "неизвестно", и remirror загрузит его сам.
+    """
+    store.add_mirror_pull(mirror_number, original_pull.number, original_pull.title,
+                          original_pull.merge_commit_sha, known_commits(original_pull), branch, base_sha)
 
-def check_processed_pr(pr_number):
-    data = read_work_log()
-    if pr_number in data['processed_prs']:
-        return True
-    else:
-        return False
 
-def get_processing_prs():
+def add_batch_pull(store, mirror_number, title, pulls, branch, base_sha):
     """
-    Возвращает список обработанных PR.
+    Запоминает PR пакетного режима и все исходные PR пакета, чтобы remirror
+    пересобрал ветку пакета целиком.
     """
-    data = read_work_log()
-    return data['processing_prs']
+    store.add_batch_pull(mirror_number, title,
+                         [(pull.number, pull.title, pull.merge_commit_sha, known_commits(pull)) for pull in pulls],
+                         branch, base_sha)
+
 
+def known_commits(pull):
+    return [c.sha for c in pull.commits] if pull.commits is not None else []
 
-def get_processed_prs():
+
+def get_mirror_pull(store, mirror_number):
+    return store.get_mirror_pull(mirror_number)
+
+
+def update_mirror_base(store, mirror_number, base_sha):
+    store.update_mirror_base(mirror_number, base_sha)
+
+
+def get_last_merged_prs(client, store, owner, repo, last_activation_day):
     """
-    Возвращает список обработанных PR.
+    Возвращает слитые после last_activation_day PR предка, которые ещё не
+    обработаны и не ожидают обработки, от новых к старым.
     """
-    data = read_work_log()
-    return data['processed_prs']
-
-
-def get_last_merged_prs(repo, last_activation_day, limit=10):
-    try:
-        # Формируем команду
-        command = [
-            "gh", "pr", "list",
-            "--repo", repo,
-            "--state", "merged",
-            "--limit", str(limit),
-            "--json", "mergedAt,number"
-        ]
-
-        print(f"Выполнение команды: {' '.join(command)}")
-        # Выполняем команду и захватываем вывод
-        result = subprocess.run(
-            command,
-            capture_output=True,  # Захватить stdout и stderr
-            text=True,            # Работать с текстом (не байтами)
-            check=True,           # Выбросить исключение при ошибке
-            encoding='utf-8'      # Указать кодировку
-        )
-
-        prs_data = json.loads(result.stdout)
-        # print(f"Получено PR: {len(prs_data)}")
-        # pr_numbers = [pr["number"] for pr in prs_data]
-        # print(f"Входной список PR: {pr_numbers}")
-
-        # 1. Фильтр по mergedAt
-        filtered_prs = [
-            pr for pr in prs_data
-            if (merged_at := pr.get("mergedAt")) and datetime.fromisoformat(merged_at) >= datetime.fromisoformat(last_activation_day)
-        ]
-        # print(f"После фильтрации по дате осталось {len(filtered_prs)} PR")
-
-        # 2. Исключаем уже обработанные
-        processed_prs = set(get_processed_prs())  # set для быстрого поиска
-        filtered_prs = [pr for pr in filtered_prs if pr.get(
-            "number") not in processed_prs]
-        # print(f"После исключения обработанных осталось {len(filtered_prs)} PR")
-
-        # 3. Оставляем только те, что сейчас в процессе
-        processing_prs = set(get_processing_prs())
-        filtered_prs = [pr for pr in filtered_prs if pr.get(
-            "number") not in processing_prs]
-        # print(f"После фильтрации по 'в обработке' осталось {len(filtered_prs)} PR")
-
-        # 4. Сортируем PR по дате мерджа (от новых к старым)
-        filtered_prs.sort(key=lambda pr: datetime.fromisoformat(pr['mergedAt']), reverse=True)
-
-        # 5. Оставляем только номера PR
-        pr_numbers = [pr["number"] for pr in filtered_prs]
-
-        # print(f"Итоговый список PR: {pr_numbers}")
-        return pr_numbers
-
-    except subprocess.CalledProcessError as e:
-        logger.critical(f"Ошибка при выполнении команды `gh`:")
-        logger.critical(f"Команда: {' '.join(e.cmd)}")
-        logger.critical(f"Код возврата: {e.returncode}")
-        logger.critical(f"Stderr: {e.stderr.strip()}")
-        sys.exit()
-    except json.JSONDecodeError:
-        logger.critical("Ошибка: Не удалось распарсить JSON-ответ от `gh`.")
-        sys.exit()
-    except Exception as e:
-        logger.critical(f"Произошла непредвиденная ошибка: {e}")
-        sys.exit()
-
-    except subprocess.CalledProcessError as e:
-        logger.critical(f"Ошибка выполнения команды: {e.stderr}")
-        sys.exit()
+    pulls = client.get_merged_pulls_since(owner, repo, last_activation_day)
+    processing_prs = set(store.get_processing_prs())
+    return [pull for pull in pulls
+            if not store.is_processed(pull.number) and pull.number not in processing_prs]
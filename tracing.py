@@ -0,0 +1,60 @@
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+import config
+
+# Трасса, в которой выполняется текущий код: (trace id, PR)
+current = contextvars.ContextVar("trace", default=None)
+
+# trace id PR, обработка которых могла начаться недавно. Этапы асинхронного движка
+# и повторные попытки одного PR попадают в одну трассу
+MAX_TRACES = 10000
+traces = OrderedDict()
+traces_lock = threading.Lock()
+
+
+def trace_id(key):
+    with traces_lock:
+        if key not in traces:
+            traces[key] = uuid.uuid4().hex[:16]
+            if len(traces) > MAX_TRACES:
+                traces.popitem(last=False)
+        return traces[key]
+
+
+@contextmanager
+def pull(repo, number):
+    """
+    Выполняет блок в трассе PR number репозитория repo. Записи лога внутри блока,
+    в том числе из потоков asyncio.to_thread, получают trace id и номер PR.
+    """
+    token = current.set((trace_id((repo, number)), number))
+    try:
+        yield
+    finally:
+        current.reset(token)
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Пишет в лог запись о длительности блока. Поля fields и значения, добавленные
+    в них внутри блока, попадают в запись.
+    """
+    start = time.monotonic()
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = type(e).__name__
+        raise
+    finally:
+        if config.trace_spans:
+            duration = time.monotonic() - start
+            details = "".join(f" {key}={value}" for key, value in fields.items())
+            logging.getLogger("log.trace").info(
+                f"{name}: {duration:.3f} с{details}",
+                extra={"span": name, "duration": round(duration, 4), "fields": fields})
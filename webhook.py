@@ -0,0 +1,170 @@
+import os
+import sys
+import hmac
+import json
+import queue
+import hashlib
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from api import Event
+
+# Соответствие типов вебхуков типам событий из ленты /events
+EVENT_TYPES = {
+    "pull_request": "PullRequestEvent",
+    "issue_comment": "IssueCommentEvent"
+}
+# GitHub не отправляет вебхуки больше 25 МБ, тело большего размера не читается
+MAX_BODY_SIZE = 25 * 1024 * 1024
+
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, signature):
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body), signature)
+
+
+class WebhookReceiver:
+    """
+    HTTP приёмник вебхуков GitHub.
+    Проверяет подпись, отбрасывает повторные доставки и передаёт события в очередь,
+    которую разбирает основной поток.
+    """
+
+    def __init__(self, secret, host, port, dedupe_size=1000):
+        self.logger = logging.getLogger("log")
+        self.secret = secret
+        self.address = (host, port)
+        self.dedupe_size = dedupe_size
+        self.deliveries = OrderedDict()
+        self.deliveries_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length, status = receiver.body_length(self.headers.get("Content-Length"))
+                if status:
+                    # Непрочитанное тело нельзя пропустить, поэтому соединение закрывается
+                    self.close_connection = True
+                    self.send_response(status)
+                    self.end_headers()
+                    return
+                body = self.rfile.read(length)
+                status = receiver.accept(
+                    self.headers.get("X-GitHub-Event"),
+                    self.headers.get("X-GitHub-Delivery"),
+                    self.headers.get("X-Hub-Signature-256"),
+                    body)
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                receiver.logger.debug(f"Вебхук: {format % args}")
+
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.logger.info(f"Приём вебхуков на {self.address[0]}:{self.server.server_address[1]}.")
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def body_length(self, content_length):
+        """
+        Проверяет заголовок Content-Length до чтения тела. Возвращает длину тела
+        и None или HTTP код ответа, если тело читать нельзя.
+        """
+        try:
+            length = int(content_length)
+        except (TypeError, ValueError):
+            length = -1
+        if length < 0:
+            self.logger.warning(f"Вебхук с неверным Content-Length {content_length!r} отклонён.")
+            return None, 400
+        if length > MAX_BODY_SIZE:
+            self.logger.warning(f"Вебхук размером {length} байт отклонён.")
+            return None, 413
+        return length, None
+
+    def accept(self, event_name, delivery_id, signature, body):
+        """
+        Обрабатывает одну доставку и возвращает HTTP код ответа.
+        """
+        if not verify_signature(self.secret, body, signature):
+            self.logger.warning(f"Вебхук {delivery_id} с неверной подписью отклонён.")
+            return 401
+        if event_name == "ping":
+            return 200
+        if event_name not in EVENT_TYPES:
+            return 202
+        try:
+            payload = json.loads(body)
+            full_name = payload["repository"]["full_name"]
+        except (json.JSONDecodeError, UnicodeDecodeError, TypeError, KeyError):
+            self.logger.warning(f"Вебхук {delivery_id} без репозитория или с неверным JSON отклонён.")
+            return 400
+        # Доставка запоминается только после проверки, чтобы повтор исправленного запроса не был отброшен
+        with self.deliveries_lock:
+            if delivery_id in self.deliveries:
+                self.logger.debug(f"Повторная доставка {delivery_id}. Пропуск.")
+                return 200
+            self.deliveries[delivery_id] = True
+            if len(self.deliveries) > self.dedupe_size:
+                self.deliveries.popitem(last=False)
+        event = Event({"id": delivery_id, "type": EVENT_TYPES[event_name], "payload": payload})
+        self.queue.put((full_name, event))
+        return 202
+
+    def events(self, timeout=None):
+        """
+        Выдаёт полученные события. Если за timeout секунд событий не было, выдаёт None,
+        чтобы потребитель мог выполнить отложенную работу.
+        """
+        while True:
+            try:
+                yield self.queue.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+
+
+def replay(directory, url, secret):
+    """
+    Отправляет записанные вебхуки из каталога на приёмник.
+    Каждый файл - JSON вида {"event": "pull_request", "delivery": "...", "payload": {...}}.
+    """
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        body = json.dumps(record["payload"]).encode()
+        request = urllib.request.Request(url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "X-GitHub-Event": record["event"],
+            "X-GitHub-Delivery": record.get("delivery", name),
+            "X-Hub-Signature-256": sign(secret, body)
+        })
+        with urllib.request.urlopen(request) as response:
+            print(f"{name}: {response.status}")
+
+
+if __name__ == "__main__":
+    # python webhook.py <каталог с записями> [адрес приёмника]
+    import config
+    replay(sys.argv[1],
+           sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{config.webhook_port}/",
+           config.webhook_secret)
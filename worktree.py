@@ -0,0 +1,40 @@
+import os
+import queue
+import logging
+from contextlib import contextmanager
+from gitcmd import run_git
+
+
+class WorktreePool:
+    """
+    Набор рабочих каталогов для параллельного зеркалирования.
+    Первый каталог - сам локальный клон, остальные - git worktree поверх его хранилища объектов.
+    """
+
+    def __init__(self, repo_directory, size):
+        self.logger = logging.getLogger("log")
+        self.repo_directory = repo_directory
+        self.size = max(1, size)
+        self.paths = [repo_directory] + [
+            os.path.join(f"{repo_directory}-worktrees", f"worker-{i}") for i in range(1, self.size)
+        ]
+        self.free = queue.Queue()
+
+    def prepare(self):
+        run_git(self.repo_directory, "worktree", "prune")
+        for path in self.paths[1:]:
+            if not os.path.isdir(path):
+                self.logger.info(f"Создание рабочего каталога {path}.")
+                run_git(self.repo_directory, "worktree", "add", "--detach", os.path.abspath(path), check=True)
+        while not self.free.empty():
+            self.free.get_nowait()
+        for path in self.paths:
+            self.free.put(path)
+
+    @contextmanager
+    def acquire(self):
+        path = self.free.get()
+        try:
+            yield path
+        finally:
+            self.free.put(path)